@@ -1,9 +1,13 @@
+import time
+RERUN_START = time.perf_counter()
+
 import streamlit as st
-from sentence_transformers import SentenceTransformer
-from retrieve import retrieve_answer, load_index, load_corpus
-import json
-from collections import defaultdict
-import numpy as np
+from retrieve import enhanced_search, warm_query_cache, lexical_search
+from reloader import BundleWatcher
+from encoders import EncoderLoader
+from rerank import Reranker, RERANK_ENABLED
+from metrics import stage_metrics, trace, QueryLog
+from precompute import AnswerTable
 
 # Updated: 2025-08-05 - Enhanced corpus with SET survey content - FIXED NAVIGATION
 
@@ -150,70 +154,66 @@ st.markdown("""
 # ----------------------------
 # Load data
 # ----------------------------
-@st.cache_data
+# Queries sent by the Quick Access and Browse by Category buttons
+BUTTON_QUERIES = [
+    "emergency procedures",
+    "FERPA guidelines",
+    "SET survey interpretation",
+    "educational innovation grants",
+    "teaching resources syllabus",
+    "teaching strategies classroom",
+    "assessment evaluation feedback",
+    "student mental health counseling",
+    "accessibility inclusion digital",
+    "emergency safety procedures",
+    "legal compliance FERPA",
+    "grants funding innovation",
+]
+
+# MMR weight for the result list: higher spreads the five slots over more distinct answers
+RESULT_DIVERSITY = 0.3
+
+@st.cache_resource
 def load_data():
-    index = load_index("faiss_index.bin")
-    corpus = load_corpus("corpus.pkl")
-    model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
-    return index, corpus, model
-
-index, corpus, model = load_data()
-
-# ----------------------------
-# Categorize corpus
-# ----------------------------
-def categorize_qa(corpus):
-    categories = defaultdict(list)
-    for item in corpus:
-        # Use pre-defined category if available, otherwise fall back to keyword matching
-        if "category" in item and item["category"]:
-            category = item["category"]
-        else:
-            # Fallback categorization based on keywords
-            question_lower = item["question"].lower()
-            if any(word in question_lower for word in ["emergency", "safety", "crisis", "threat", "evacuation"]):
-                category = "Emergency & Safety"
-            elif any(word in question_lower for word in ["ferpa", "legal", "compliance", "privacy", "title ix"]):
-                category = "Legal & Compliance"
-            elif any(word in question_lower for word in ["grant", "funding", "innovation", "educational"]):
-                category = "Grants & Funding"
-            elif any(word in question_lower for word in ["student", "mental health", "counseling", "wellbeing"]):
-                category = "Student Support"
-            elif any(word in question_lower for word in ["accessibility", "digital", "wcag", "inclusive"]):
-                category = "Accessibility & Inclusion"
-            elif any(word in question_lower for word in ["feedback", "survey", "evaluation", "reflection"]):
-                category = "Teaching Improvement"
-            elif any(word in question_lower for word in ["syllabus", "course", "teaching", "classroom"]):
-                category = "Teaching Resources"
-            else:
-                category = "General"
-        
-        item["category"] = category
-        categories[category].append(item)
-    
-    return dict(categories)
-
-categorized_corpus = categorize_qa(corpus)
-
-# ----------------------------
-# Enhanced search function
-# ----------------------------
-def enhanced_search(query, model, corpus, index, k=5):
-    query_embedding = model.encode([query], normalize_embeddings=True)
-    scores, indices = index.search(np.array(query_embedding, dtype=np.float32), k)
-    
-    results = []
-    for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-        if idx < len(corpus):
-            results.append({
-                "question": corpus[idx]["question"],
-                "answer": corpus[idx]["answer"],
-                "category": corpus[idx].get("category", "General"),
-                "relevance_score": float(score),
-                "rank": i + 1
-            })
-    
-    return results
+    """Load everything once per server process; shared by all sessions and reruns without copying"""
+    timings = {}
+    start = time.perf_counter()
+    # Swaps in new bundles written by embed_index.py without a restart
+    watcher = BundleWatcher("index_bundle")
+    timings["bundle"] = time.perf_counter() - start
+    # Searches are logged to QUERY_LOG_DIR for precompute.py (empty: off)
+    stage_metrics.query_log = QueryLog()
+
+    # Optional cross-encoder reranking (RERANK=1), loaded along with the encoder
+    reranker = Reranker() if RERANK_ENABLED else None
+    # Head searches mined from the query logs (python precompute.py) are a dictionary lookup
+    answer_table = AnswerTable.load()
+    timings["answer_table"] = time.perf_counter() - start - timings["bundle"]
+
+    def on_ready(model):
+        warm_query_cache(BUTTON_QUERIES, model)
+        if reranker is not None:
+            try:
+                reranker.load()
+            except Exception as exc:
+                print(f"⚠️ Reranker failed to load ({exc}); showing dense order")
+
+    # The encoder loads in the background so the page renders right away;
+    # searches use keyword matching until it is ready
+    encoder = EncoderLoader(watcher.current.model_name, watcher=watcher, on_ready=on_ready)
+    encoder.start()
+
+    timings["total"] = time.perf_counter() - start
+    print("⏱️ Cold start: " + ", ".join(f"{name} {secs * 1000:.0f} ms" for name, secs in timings.items()))
+    return watcher, encoder, reranker, answer_table, timings
+
+watcher, encoder, reranker, answer_table, startup_timings = load_data()
+
+# Cold start of this server process, and the previous rerun of this session (measured at the end of the script)
+with st.sidebar.expander("⏱️ Performance"):
+    st.caption("Cold start: " + ", ".join(f"{name} {secs * 1000:.0f} ms" for name, secs in startup_timings.items()))
+    if "last_rerun_ms" in st.session_state:
+        st.caption(f"Previous rerun: {st.session_state.last_rerun_ms:.1f} ms")
 
 # ----------------------------
 # Initialize session state
@@ -287,7 +287,24 @@ if search_button and query.strip():
 
 if st.session_state.show_results and st.session_state.search_query:
     with st.spinner("Searching our knowledge base..."):
-        results = enhanced_search(st.session_state.search_query, model, corpus, index, k=5)
+        with trace("search", st.session_state.search_query) as search_trace, watcher.snapshot() as bundle:
+            table_params = {"k": 5, "threshold": 0.0, "diversity": RESULT_DIVERSITY, "lexical": bundle.lexical is not None,
+                            "reranked": reranker is not None}
+            results = answer_table.get("search", st.session_state.search_query, bundle.version, table_params) if answer_table else None
+            if results is None and encoder.ready:
+                results = enhanced_search(st.session_state.search_query, encoder.encoder, bundle.corpus, bundle.index, k=5, threshold=0.0, lexical=bundle.lexical,
+                                          reranker=reranker, diversity=RESULT_DIVERSITY)
+            elif results is None:
+                results = lexical_search(st.session_state.search_query, bundle.corpus, bundle.lexical, k=5, keyword_only=False) or []
+            # Top hit for the query log (precompute.py mines it for head queries and misses)
+            if results:
+                search_trace.hit, search_trace.score = results[0]["question"], results[0]["relevance_score"]
+    
+    if not encoder.ready:
+        st.caption("Semantic search is still loading; showing keyword matches for now.")
+    # Stage breakdown of this search (cache hits show no stages)
+    st.caption(f"Searched in {search_trace.total * 1000:.0f} ms"
+               + "".join(f" · {stage} {secs * 1000:.1f} ms" for stage, secs in search_trace.stages.items()))
     
     if results:
         st.markdown(f"### Search Results ({len(results)} found)")
@@ -524,3 +541,5 @@ st.markdown("""
     <a href="https://ucla.edu" target="_blank">UCLA Home</a>
 </div>
 """, unsafe_allow_html=True)
+
+st.session_state.last_rerun_ms = (time.perf_counter() - RERUN_START) * 1000
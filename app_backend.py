@@ -1,27 +1,251 @@
-from flask import Flask, request, jsonify
+import os
+import json
+import time
+import threading
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
-from retrieve import load_index, load_corpus, retrieve_answer
+from retrieve import cache_stats, answer_stream, iter_question_records, filtered_search, FALLBACK_ANSWER
+from reloader import BundleWatcher
+from batcher import QueryBatcher
+from encoders import EncoderLoader
+from rerank import Reranker, RERANK_ENABLED
+from precompute import AnswerTable
+from metrics import stage_metrics, trace, QueryLog
 
 app = Flask(__name__)
 CORS(app)
 
-index = load_index("faiss_index.bin")
-corpus = load_corpus("corpus.pkl")
-model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+# The bundle is loaded at import: with `gunicorn --preload` (see gunicorn.conf.py)
+# it is shared by the workers through the page cache. New bundle versions
+# written by embed_index.py are swapped in without a restart (polled every
+# BUNDLE_RELOAD_INTERVAL seconds).
+watcher = BundleWatcher("index_bundle")
+# Served queries are logged to QUERY_LOG_DIR for precompute.py (empty: off)
+stage_metrics.query_log = QueryLog()
+
+# Concurrent /ask requests share one encode + search (ASK_BATCH_WINDOW_MS, ASK_MAX_BATCH).
+# Until the encoder has loaded, questions are answered from BM25 alone.
+# RERANK=1 adds a cross-encoder pass over each question's top candidates (see rerank.py)
+reranker = Reranker() if RERANK_ENABLED else None
+# Head questions mined from the query logs by precompute.py are answered by a lookup
+answer_table = AnswerTable.load()
+batcher = QueryBatcher(None, k=1, watcher=watcher, reranker=reranker, answer_table=answer_table)
+
+def _encoder_ready(encoder):
+    if reranker is not None:
+        try:
+            reranker.load()
+        except Exception as exc:
+            # Answers keep the dense order
+            print(f"⚠️ Reranker failed to load ({exc}); serving without it")
+    batcher.model = encoder
+
+# The encoder (ENCODER_BACKEND) loads on a background thread so the port is
+# bound right away; /ready reports when semantic search is available
+encoder = EncoderLoader(watcher.current.model_name, watcher=watcher, on_ready=_encoder_ready)
+
+# Requests beyond this many in flight get a 503 instead of queueing without bound
+MAX_INFLIGHT = int(os.environ.get("ASK_MAX_INFLIGHT", "64"))
+inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+rejected = 0
+# Questions per batched encode + search on /ask/batch
+BATCH_CHUNK_SIZE = int(os.environ.get("ASK_BATCH_CHUNK_SIZE", "256"))
+
+@app.before_request
+def start_encoder():
+    # Covers servers that fork without the gunicorn hooks; a no-op once loading
+    encoder.start()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = {"ready": encoder.ready, "mode": "hybrid" if encoder.ready else "lexical", "encoder": encoder.stats()}
+    return jsonify(status), 200 if encoder.ready else 503
 
 @app.route("/ask", methods=["POST"])
 def ask_question():
-    data = request.get_json()
-    query = data.get("question", "").strip().lower()
+    global rejected
+    if not inflight.acquire(blocking=False):
+        rejected += 1
+        return jsonify({"error": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+    try:
+        with trace("ask") as current:
+            start = time.perf_counter()
+            data = request.get_json()
+            # Case is kept for acronym detection (CAPS, SET); caches normalize it
+            query = data.get("question", "").strip()
+            current.query = query
+            stage_metrics.observe("parse", time.perf_counter() - start)
+
+            # ✅ Use FAISS retrieval
+            results = batcher.ask(query)
+            answer = results[0] if results else FALLBACK_ANSWER
+            return jsonify({"answer": answer})
+    finally:
+        inflight.release()
+
+@app.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """Newline-delimited JSON events: a BM25 preview right away (when the answer isn't
+    already known), then the final answer once the batched dense search is done"""
+    global rejected
+    if not inflight.acquire(blocking=False):
+        rejected += 1
+        return jsonify({"error": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+    try:
+        data = request.get_json()
+        query = data.get("question", "").strip()
+    except Exception:
+        inflight.release()
+        raise
+
+    def events():
+        start = time.perf_counter()
+
+        def event(kind, answers, source):
+            answer = answers[0] if answers else FALLBACK_ANSWER
+            elapsed = round((time.perf_counter() - start) * 1000, 1)
+            return json.dumps({"type": kind, "answer": answer, "source": source, "elapsed_ms": elapsed}) + "\n"
+
+        with trace("ask_stream", query):
+            quick = batcher.quick_answer(query, tentative=True)
+            if quick is not None:
+                answers, source, final = quick
+                yield event("final" if final else "preliminary", answers, source)
+                if final:
+                    return
+            yield event("final", batcher.ask_dense(query), "dense")
+
+    # Unbuffered so each event reaches the client as soon as it is written
+    response = Response(stream_with_context(events()), mimetype="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Released when the server closes the response, even if the client went away before streaming began
+    response.call_on_close(inflight.release)
+    return response
+
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    """Answer many questions with one encode + search per BATCH_CHUNK_SIZE questions.
+
+    A JSON body {"questions": [...]} gets {"answers": [...], "summary": {...}}.
+    An application/x-ndjson body (one {"question": ...} object or JSON string
+    per line) is read and answered as it streams in, and each answer is written
+    back as an NDJSON line, followed by a {"summary": ...} line.
+    """
+    global rejected
+    if not encoder.ready:
+        return jsonify({"error": "Semantic search is still loading, please try again shortly."}), 503, {"Retry-After": "5"}
+    if not inflight.acquire(blocking=False):
+        rejected += 1
+        return jsonify({"error": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+    def summary(count, start):
+        seconds = time.perf_counter() - start
+        return {"count": count, "seconds": round(seconds, 3), "qps": round(count / seconds, 1) if seconds else None}
+
+    if request.mimetype != "application/x-ndjson":
+        try:
+            with trace("ask_batch"), watcher.snapshot() as bundle:
+                start = time.perf_counter()
+                questions = (request.get_json() or {}).get("questions", [])
+                records = ({"question": question} if isinstance(question, str) else question for question in questions)
+                answers = list(answer_stream(records, encoder.encoder, bundle.corpus, bundle.index, BATCH_CHUNK_SIZE))
+                return jsonify({"answers": answers, "summary": summary(len(answers), start)})
+        finally:
+            inflight.release()
+
+    def rows():
+        with trace("ask_batch"), watcher.snapshot() as bundle:
+            start, count = time.perf_counter(), 0
+            records = iter_question_records(request.stream)
+            for row in answer_stream(records, encoder.encoder, bundle.corpus, bundle.index, BATCH_CHUNK_SIZE):
+                count += 1
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": summary(count, start)}) + "\n"
+
+    response = Response(stream_with_context(rows()), mimetype="application/x-ndjson")
+    response.call_on_close(inflight.release)
+    return response
+
+@app.route("/search", methods=["POST"])
+def search():
+    """Top-k results with metadata filters and boosts, e.g.
+    {"query": "...", "categories": ["Legal & Compliance"], "min_priority": "high", "updated_since": "2024-01-01"}.
+    Optional: k, tags (any of), priority_boost, recency_boost."""
+    global rejected
+    if not encoder.ready:
+        return jsonify({"error": "Semantic search is still loading, please try again shortly."}), 503, {"Retry-After": "5"}
+    if not inflight.acquire(blocking=False):
+        rejected += 1
+        return jsonify({"error": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+    try:
+        with trace("filtered_search") as current, watcher.snapshot() as bundle:
+            data = request.get_json() or {}
+            current.query = data.get("query", "").strip()
+            try:
+                for field in ("categories", "tags"):
+                    values = data.get(field)
+                    # A bare string would otherwise be matched one character at a time
+                    if values is not None and not (isinstance(values, list) and all(isinstance(v, str) for v in values)):
+                        raise ValueError(f"{field} must be a list of strings, got {values!r}")
+                results = filtered_search(current.query, encoder.encoder, bundle.corpus, bundle.index, bundle.metadata,
+                                          k=int(data.get("k", 5)), threshold=float(data.get("threshold", 0.15)),
+                                          categories=data.get("categories"), tags=data.get("tags"),
+                                          min_priority=data.get("min_priority"), updated_since=data.get("updated_since"),
+                                          priority_boost=float(data.get("priority_boost", 0.0)),
+                                          recency_boost=float(data.get("recency_boost", 0.0)))
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
+            if results:
+                current.hit, current.score = results[0]["question"], results[0]["relevance_score"]
+            return jsonify({"results": results})
+    finally:
+        inflight.release()
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "cache": cache_stats(),
+        "batching": batcher.stats(),
+        "bundle": watcher.stats(),
+        "encoder": encoder.stats(),
+        "rerank": reranker.stats() if reranker is not None else None,
+        "answer_table": answer_table.stats() if answer_table is not None else None,
+        "query_log": stage_metrics.query_log.stats(),
+        "inflight": {"limit": MAX_INFLIGHT, "rejected": rejected, "pid": os.getpid()},
+    })
 
-    # ✅ Use FAISS retrieval
-    results = retrieve_answer(query, model, corpus, index, k=1)
-    answer = results[0] if results else (
-        "Not enough information available. "
-        "Please contact [TLC Consultations](https://teaching.ucla.edu/services/consultations/) for further support."
-    )
-    return jsonify({"answer": answer})
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition: per-stage latency histograms plus serving gauges"""
+    caches = cache_stats()
+    batching = batcher.stats()
+    gauges = {
+        "embedding_cache_hit_rate": caches["embeddings"]["hit_rate"],
+        "result_cache_hit_rate": caches["results"]["hit_rate"],
+        "semantic_cache_hit_rate": caches["semantic"]["hit_rate"],
+        "semantic_cache_size": caches["semantic"]["size"],
+        "semantic_cache_invalidations": caches["semantic"]["invalidations"],
+        "batcher_avg_batch_size": batching["avg_batch_size"],
+        "batcher_lexical_fallbacks": batching["lexical_fallbacks"],
+        "ask_rejected": rejected,
+        "ask_inflight_limit": MAX_INFLIGHT,
+        "encoder_ready": encoder.ready,
+        "bundle_reloads": watcher.stats()["reloads"],
+        "slow_queries_logged": stage_metrics.slow_log.logged,
+        "query_log_dropped": stage_metrics.query_log.dropped,
+        "batcher_table_hits": batching["table_hits"],
+    }
+    if reranker is not None:
+        rerank_stats = reranker.stats()
+        gauges["rerank_ready"] = rerank_stats["ready"]
+        gauges["rerank_budget_fallbacks"] = rerank_stats["budget_fallbacks"]
+        gauges["rerank_cache_hits"] = rerank_stats["cache_hits"]
+    return Response(stage_metrics.render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
+    # Development server; for production use: gunicorn -c gunicorn.conf.py app_backend:app
+    encoder.start()
     app.run(host="0.0.0.0", port=5001)
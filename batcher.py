@@ -0,0 +1,281 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+from retrieve import (encode_queries, best_answers, answer_cache_key, answer_scope, index_token, lexical_search, search_embeddings,
+                      result_cache, semantic_cache, corpus_columns, FALLBACK_ANSWER)
+from metrics import stage_metrics
+
+DEFAULT_WINDOW_MS = float(os.environ.get("ASK_BATCH_WINDOW_MS", "5"))
+DEFAULT_MAX_BATCH = int(os.environ.get("ASK_MAX_BATCH", "32"))
+
+class QueryBatcher:
+    """Coalesces concurrent questions into one batched encode and one FAISS search.
+
+    Callers block in `ask` while a single worker thread collects everything that
+    arrives within `window_ms` of the first pending question (or until
+    `max_batch` questions are waiting), answers the whole batch at once and
+    hands each caller its own result. Given a `watcher` (reloader.BundleWatcher)
+    instead of a fixed corpus and index, every batch runs on the bundle
+    snapshot that is current when the batch starts. While `model` is None
+    (still loading, see encoders.EncoderLoader) questions are answered from
+    BM25 alone. Given a `reranker` (rerank.Reranker), each question's top
+    candidates are reordered by the cross-encoder in one shared call per batch.
+    Questions close enough to a recently answered one (retrieve.semantic_cache)
+    are answered after the encode, without searching or reranking. Head
+    questions found in an `answer_table` (precompute.AnswerTable) for the
+    bundle being served skip the model entirely.
+    """
+
+    def __init__(self, model, corpus=None, index=None, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH, k=1, threshold=0.20, watcher=None, lexical=None,
+                 reranker=None, answer_table=None):
+        self.model = model
+        self.corpus = corpus
+        self.index = index
+        self.lexical = lexical
+        self.watcher = watcher
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.k = k
+        self.threshold = threshold
+        self.reranker = reranker
+        self.answer_table = answer_table
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.cache_hits = 0
+        self.table_hits = 0
+        self.semantic_hits = 0
+        self.lexical_hits = 0
+        self.lexical_fallbacks = 0
+        self.largest_batch = 0
+        self.encode_seconds = 0.0
+        self.search_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def _ensure_started(self):
+        # Started lazily so a pre-forked worker gets its own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    @contextmanager
+    def _data(self):
+        """One bundle's corpus, index, lexical index and version (None without a watcher) for the duration of a query"""
+        if self.watcher is None:
+            yield self.corpus, self.index, self.lexical, None
+        else:
+            with self.watcher.snapshot() as bundle:
+                yield bundle.corpus, bundle.index, bundle.lexical, bundle.version
+
+    def ask(self, query, timeout=30):
+        """Answer one question, sharing the model call with concurrent callers"""
+        quick = self.quick_answer(query)
+        if quick is not None:
+            return quick[0]
+        return self.ask_dense(query, timeout)
+
+    def quick_answer(self, query, tentative=False):
+        """An answer that needs no model call, as (answers, source, final), or None.
+
+        Final answers come from the precomputed answer table, the result cache,
+        the keyword-only BM25 path, or BM25 alone while the encoder is loading. With `tentative`, any other
+        question gets its BM25 top hit as a non-final preview, shown while
+        `ask_dense` computes the real answer.
+        """
+        # One bundle snapshot for every lookup, so a reload mid-call can't mix versions
+        with self._data() as (corpus, index, lexical, version):
+            if self.answer_table is not None and version is not None:
+                params = {"k": self.k, "threshold": self.threshold, "reranked": self.reranker is not None}
+                answers = self.answer_table.get("ask", query, version, params)
+                if answers is not None:
+                    with self._stats_lock:
+                        self.table_hits += 1
+                    return answers, "precomputed", True
+
+            cached = result_cache.get(self._cache_key(query, index))
+            if cached is not None:
+                with self._stats_lock:
+                    self.cache_hits += 1
+                return list(cached), "cache", True
+
+            # Keyword-only questions are answered from BM25 without queueing for the model
+            results = lexical_search(query, corpus, lexical, k=1)
+            if results:
+                with self._stats_lock:
+                    self.lexical_hits += 1
+                stage_metrics.annotate(results[0]["question"], results[0]["relevance_score"])
+                return [results[0]["answer"]], "lexical", True
+
+            if self.model is None or tentative:
+                results = lexical_search(query, corpus, lexical, k=1, keyword_only=False)
+        if self.model is None:
+            with self._stats_lock:
+                self.lexical_fallbacks += 1
+            return ([results[0]["answer"]] if results else []), "lexical", True
+        if tentative and results:
+            return [results[0]["answer"]], "lexical", False
+        return None
+
+    def _cache_key(self, query, index):
+        return answer_cache_key(query, index, self.k, self.threshold, self.reranker is not None)
+
+    def ask_dense(self, query, timeout=30):
+        """Queue a question for the next batched encode + search and wait for its answer"""
+        future = Future()
+        self._ensure_started()
+        queued = time.perf_counter()
+        self._queue.put((query, future))
+        answer = future.result(timeout=timeout)
+        # The batch ran on the worker thread; credit its stages to this request
+        stages = future.stages
+        stage_metrics.observe("batch_wait", time.perf_counter() - queued - sum(stages.values()))
+        stage_metrics.add_to_trace(stages)
+        stage_metrics.annotate(*future.top)
+        return answer
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        queries = [query for query, _ in batch]
+        try:
+            with self._data() as (corpus, index, _, _):
+                start = time.perf_counter()
+                embeddings = encode_queries(queries, self.model)
+                encoded = time.perf_counter()
+                scope = answer_scope(self.k, self.threshold, self.reranker is not None)
+                answers = semantic_cache.get_many(scope, embeddings, index_token(index))
+                misses = [i for i, answer in enumerate(answers) if answer is None]
+                searched = reranked_at = encoded
+                fresh = []
+                # (matched question, score) per question for the query log; unknown for semantic-cache hits
+                tops = [(None, None)] * len(queries)
+                if misses and self.reranker is None:
+                    scores, indices = index.search(embeddings[misses], self.k)
+                    searched = reranked_at = time.perf_counter()
+                    fresh = best_answers(scores, indices, corpus, self.threshold)
+                    semantic_cache.set_many(scope, embeddings[misses], fresh, index_token(index))
+                    questions = corpus_columns(corpus).questions
+                    for i, answer, score, idx in zip(misses, fresh, scores[:, 0].tolist(), indices[:, 0].tolist()):
+                        tops[i] = (questions[idx] if answer != [FALLBACK_ANSWER] else None, score)
+                elif misses:
+                    candidates = search_embeddings(embeddings[misses], corpus, index, self.reranker.candidates, self.threshold,
+                                                   dedup=True, fetch=2 * self.reranker.candidates)
+                    searched = time.perf_counter()
+                    reranked = self.reranker.rerank_many([queries[i] for i in misses], candidates)
+                    reranked_at = time.perf_counter()
+                    fresh = [[results[0]["answer"]] if results else [FALLBACK_ANSWER] for results in reranked]
+                    for i, results in zip(misses, reranked):
+                        tops[i] = (results[0]["question"], results[0]["relevance_score"]) if results else (None, None)
+                    # Dense-order fallbacks stay out of the semantic cache so a paraphrase can still be reranked
+                    ranked = [j for j, results in enumerate(reranked) if all("rerank_score" in result for result in results)]
+                    if ranked:
+                        semantic_cache.set_many(scope, embeddings[[misses[j] for j in ranked]], [fresh[j] for j in ranked],
+                                                index_token(index))
+                for i, answer in zip(misses, fresh):
+                    answers[i] = answer
+                for query, answer in zip(queries, answers):
+                    result_cache.set(self._cache_key(query, index), answer)
+                looked_up = time.perf_counter()
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        # encode_queries observed the (batched) encode; search and lookup are observed once per batch too
+        # (search_embeddings and the reranker observe their own stages)
+        if self.reranker is None:
+            stage_metrics.observe("search", searched - encoded)
+            stage_metrics.observe("lookup", looked_up - searched)
+        stages = {"encode": encoded - start, "search": searched - encoded, "lookup": looked_up - reranked_at}
+        if self.reranker is not None:
+            stages["rerank"] = reranked_at - searched
+        for (_, future), answer, top in zip(batch, answers, tops):
+            future.stages = stages
+            future.top = top
+            future.set_result(list(answer))
+
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self.semantic_hits += len(batch) - len(misses)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.encode_seconds += encoded - start
+            self.search_seconds += searched - encoded
+            self.busy_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "cache_hits": self.cache_hits,
+                "table_hits": self.table_hits,
+                "semantic_hits": self.semantic_hits,
+                "lexical_hits": self.lexical_hits,
+                "lexical_fallbacks": self.lexical_fallbacks,
+                "avg_batch_size": self.queries / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "encode_seconds": self.encode_seconds,
+                "search_seconds": self.search_seconds,
+                "queries_per_busy_second": self.queries / self.busy_seconds if self.busy_seconds else 0.0,
+            }
+
+def compare_throughput(model, corpus, index, queries, concurrency=16, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+    """Answer the same concurrent load one-at-a-time and through the batcher; return QPS for both"""
+    from concurrent.futures import ThreadPoolExecutor
+    from retrieve import embedding_cache, retrieve_answer
+
+    def one_at_a_time(query):
+        # The unbatched /ask path: one encode + one search per request
+        return retrieve_answer(query, model, corpus, index)
+
+    batcher = QueryBatcher(model, corpus, index, window_ms=window_ms, max_batch=max_batch)
+    report = {"queries": len(queries), "concurrency": concurrency}
+    for name, fn in (("sequential", one_at_a_time), ("batched", batcher.ask)):
+        embedding_cache.clear()
+        result_cache.clear()
+        semantic_cache.clear()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            list(pool.map(fn, queries))
+            elapsed = time.perf_counter() - start
+        report[name + "_qps"] = len(queries) / elapsed
+    report["speedup"] = report["batched_qps"] / report["sequential_qps"]
+    report["batcher"] = batcher.stats()
+    return report
+
+if __name__ == "__main__":
+    import json
+    from bundle import load_bundle
+    from encoders import load_encoder
+
+    bundle = load_bundle()
+    index, corpus = bundle.index, bundle.corpus
+    model = load_encoder(bundle.model_name, bundle=bundle)
+    # Distinct queries so neither path is helped by the caches
+    queries = [item["question"] for item in corpus] * 2
+    queries = [f"{query} ({i})" for i, query in enumerate(queries)]
+    print(json.dumps(compare_throughput(model, corpus, index, queries), indent=2))
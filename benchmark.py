@@ -0,0 +1,286 @@
+"""Search latency and relevance benchmark on the Q&A corpora, at several corpus sizes.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --scales 1000,100000 --compare bench.json
+
+Queries are rule-based paraphrases of the questions in enhanced_corpus.jsonl
+and qna_corpus.jsonl, and each query's gold answer is the one its question came
+with. Every scale holds the real records (encoded with the bundle's model)
+plus clustered synthetic distractor rows up to the requested size. So recall
+shows how well the real answers hold up as the index grows, and latency shows
+what search costs at that size.
+
+For each scale this reports p50/p95/p99 latency and single-thread QPS of
+retrieve_answer, enhanced_search (dense and hybrid) and search_by_category,
+with hit@1 for retrieve_answer and recall@k/MRR for the others. With --rerank,
+the same searches also run through the cross-encoder reranker (rerank.py), so
+its quality gain and added milliseconds can be read side by side. Results are
+written as JSON; --compare flags latency or quality regressions against an
+earlier run and exits non-zero.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+import faiss
+
+from embed_index import load_corpus, assign_category, resolve_index_spec, apply_search_params, synthetic_embeddings, MAX_TRAINING_ROWS
+from bundle import embedding_text, read_manifest
+from dedup import CORPUS_FILES
+from lexical import LexicalIndex, tokenize, load_keywords
+from encoders import load_encoder
+from rerank import Reranker, RERANK_BUDGET_MS
+from retrieve import (retrieve_answer, enhanced_search, search_by_category, build_category_ids, corpus_columns,
+                      embedding_cache, result_cache, semantic_cache)
+
+DEFAULT_SCALES = "1000,100000,1000000"
+SYNTHETIC_CHUNK = 100_000
+# Regressions flagged by --compare
+MAX_LATENCY_INCREASE = 0.20
+MIN_LATENCY_DELTA_MS = 0.5
+MAX_QUALITY_DROP = 0.02
+
+SYNONYMS = {
+    "instructor": "faculty member", "instructors": "faculty", "faculty": "instructors",
+    "student": "learner", "students": "learners", "course": "class", "courses": "classes",
+    "help": "support", "resources": "materials", "improve": "strengthen", "use": "apply",
+    "get": "obtain", "find": "locate", "create": "design", "feedback": "comments",
+}
+PREFIXES = (
+    ("how do i ", "what's the way to "), ("how can i ", "ways to "), ("how can ", "in what ways can "),
+    ("how should ", "what's the best way "), ("what is ", "explain "), ("what are ", "list "),
+    ("where can i ", "where to "),
+)
+
+def load_benchmark_corpus(files=CORPUS_FILES):
+    """Records of both corpora, one per distinct question"""
+    corpus, seen = [], set()
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        for item in load_corpus(path):
+            if item["question"] in seen:
+                continue
+            seen.add(item["question"])
+            item["category"] = assign_category(item)
+            corpus.append(item)
+    return corpus
+
+def reword(question):
+    """A paraphrase: a different opening and synonyms for common words"""
+    text = question.lower().rstrip("?").strip()
+    for prefix, replacement in PREFIXES:
+        if text.startswith(prefix):
+            text = replacement + text[len(prefix):]
+            break
+    return " ".join(SYNONYMS.get(word, word) for word in text.split()) + "?"
+
+def keywords(question):
+    """A terse keyword query, as typed into a search box"""
+    return " ".join(tokenize(question)[:5])
+
+def make_queries(corpus):
+    """[(query, gold record index, variant)] with two paraphrases per question, duplicates dropped"""
+    queries, seen = [], set()
+    for gold, item in enumerate(corpus):
+        for variant, make in (("reworded", reword), ("keywords", keywords)):
+            query = make(item["question"])
+            if query and query not in seen:
+                seen.add(query)
+                queries.append((query, gold, variant))
+    return queries
+
+class ScaledCorpus:
+    """The real records followed by synthetic distractor rows generated on access"""
+
+    def __init__(self, records, size, categories):
+        self.records = records
+        self.size = max(size, len(records))
+        self.categories = categories
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if i < len(self.records):
+            return self.records[i]
+        if i >= self.size:
+            raise IndexError(i)
+        return {"question": f"Synthetic record {i}", "answer": f"Synthetic answer {i}",
+                "category": self.categories[i % len(self.categories)]}
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+def build_scaled_index(embeddings, size, spec="Flat", search_params=None):
+    """FAISS index over the real embeddings plus synthetic rows up to `size`, added in chunks"""
+    dim = embeddings.shape[1]
+    n_synthetic = max(0, size - len(embeddings))
+    chunks = (synthetic_embeddings(min(SYNTHETIC_CHUNK, n_synthetic - start), dim, seed=start)
+              for start in range(0, n_synthetic, SYNTHETIC_CHUNK))
+    index = faiss.index_factory(dim, resolve_index_spec(spec, len(embeddings) + n_synthetic), faiss.METRIC_INNER_PRODUCT)
+    first = next(chunks, None)
+    if not index.is_trained:
+        sample = embeddings if first is None else np.vstack([embeddings, first[:MAX_TRAINING_ROWS]])
+        index.train(sample)
+    index.add(embeddings)
+    if first is not None:
+        index.add(first)
+    for chunk in chunks:
+        index.add(chunk)
+    return index, apply_search_params(index, search_params)
+
+def latency_stats(latencies):
+    ms = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "qps": float(len(ms) / (ms.sum() / 1000))}
+
+def run_benchmark(name, fn, queries, corpus, k, caches=()):
+    """Time `fn(query, gold item)` per query on cold caches; score where the gold answer ranks"""
+    for cache in (embedding_cache, result_cache, semantic_cache, *caches):
+        cache.clear()
+    latencies, ranks = [], []
+    for query, gold, _ in queries:
+        start = time.perf_counter()
+        answers = fn(query, corpus[gold])
+        latencies.append(time.perf_counter() - start)
+        gold_answer = corpus[gold]["answer"]
+        ranks.append(next((rank for rank, answer in enumerate(answers, 1) if answer == gold_answer), None))
+    found = [rank for rank in ranks if rank is not None and rank <= k]
+    report = {"function": name, "queries": len(queries), **latency_stats(latencies)}
+    report["hit@1" if k == 1 else f"recall@{k}"] = len(found) / len(queries)
+    if k > 1:
+        report["mrr"] = float(sum(1.0 / rank for rank in found) / len(queries))
+    return report
+
+def benchmark_scale(records, embeddings, queries, encoder, size, k=10, spec="Flat", search_params=None, lexical=True, reranker=None):
+    start = time.perf_counter()
+    categories = sorted({item["category"] for item in records})
+    corpus = ScaledCorpus(records, size, categories)
+    index, params = build_scaled_index(embeddings, len(corpus), spec, search_params)
+    lexical_index = LexicalIndex.build(corpus, load_keywords()) if lexical else None
+    # Converted once here so the first timed query doesn't pay for it
+    corpus_columns(corpus)
+    category_ids = build_category_ids(corpus, index)
+    build_seconds = time.perf_counter() - start
+
+    def answers(results):
+        return [result["answer"] for result in results]
+
+    runs = [
+        ("retrieve_answer", lambda query, gold: retrieve_answer(query, encoder, corpus, index), 1),
+        ("enhanced_search", lambda query, gold: answers(enhanced_search(query, encoder, corpus, index, k=k, threshold=0.0)), k),
+        ("search_by_category", lambda query, gold: answers(search_by_category(query, encoder, corpus, index, gold["category"],
+                                                                              k=3, category_ids=category_ids)), 3),
+    ]
+    if lexical_index is not None:
+        runs.insert(2, ("hybrid_search", lambda query, gold: answers(enhanced_search(query, encoder, corpus, index, k=k, threshold=0.0,
+                                                                                     lexical=lexical_index)), k))
+    if reranker is not None:
+        # Same k as the runs above, so quality and milliseconds compare directly
+        runs.append(("enhanced_search+rerank", lambda query, gold: answers(enhanced_search(query, encoder, corpus, index, k=k, threshold=0.0,
+                                                                                          reranker=reranker)), k))
+        if lexical_index is not None:
+            runs.append(("hybrid_search+rerank", lambda query, gold: answers(enhanced_search(query, encoder, corpus, index, k=k, threshold=0.0,
+                                                                                            lexical=lexical_index, reranker=reranker)), k))
+    caches = (reranker.cache,) if reranker is not None else ()
+    results = [run_benchmark(name, fn, queries, corpus, run_k, caches) for name, fn, run_k in runs]
+    report = {"scale": len(corpus), "index_spec": spec, "search_params": params, "build_s": build_seconds, "results": results}
+    if reranker is not None:
+        report["rerank"] = reranker.stats()
+    return report
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Regressions of `report` against `baseline`, as printable lines"""
+    before = {(scale["scale"], run["function"]): run for scale in baseline["scales"] for run in scale["results"]}
+    regressions = []
+    for scale in report["scales"]:
+        for run in scale["results"]:
+            old = before.get((scale["scale"], run["function"]))
+            if old is None:
+                continue
+            label = f"{run['function']} @ {scale['scale']}"
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if run[key] > old[key] * (1 + MAX_LATENCY_INCREASE) and run[key] - old[key] > MIN_LATENCY_DELTA_MS:
+                    regressions.append(f"{label}: {key} {old[key]:.2f} -> {run[key]:.2f}")
+            for key in run:
+                if (key.startswith(("recall@", "hit@")) or key == "mrr") and key in old and run[key] < old[key] - MAX_QUALITY_DROP:
+                    regressions.append(f"{label}: {key} {old[key]:.3f} -> {run[key]:.3f}")
+    return regressions
+
+def print_report(report):
+    print(f"\n{'function':<20}{'scale':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'QPS':>8}  quality")
+    for scale in report["scales"]:
+        for run in scale["results"]:
+            quality = ", ".join(f"{key} {run[key]:.3f}" for key in run if key.startswith(("recall@", "hit@")) or key == "mrr")
+            print(f"{run['function']:<20}{scale['scale']:>9}{run['p50_ms']:>9.2f}{run['p95_ms']:>9.2f}"
+                  f"{run['p99_ms']:>9.2f}{run['qps']:>8.0f}  {quality}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search latency and relevance at several corpus sizes")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated corpus sizes (real rows + synthetic distractors)")
+    parser.add_argument("--index-spec", default="Flat", help='FAISS factory spec, e.g. "HNSW32" (see embed_index.py)')
+    parser.add_argument("--k", type=int, default=10, help="cutoff for recall@k and MRR")
+    parser.add_argument("--max-queries", type=int, help="benchmark a sample of the generated queries")
+    parser.add_argument("--no-lexical", action="store_true", help="skip the BM25 index and hybrid_search")
+    parser.add_argument("--rerank", action="store_true", help="also run enhanced/hybrid search with cross-encoder reranking")
+    parser.add_argument("--rerank-budget-ms", type=float, default=RERANK_BUDGET_MS, help="per-query reranking budget")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="keep the semantic answer cache on (paraphrased benchmark queries then hit it)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON from an earlier run; exit 1 on regressions")
+    args = parser.parse_args()
+
+    # Off by default: the generated queries are paraphrases of each other, so it would flatter every run
+    semantic_cache.enabled = args.semantic_cache
+    records = load_benchmark_corpus()
+    queries = make_queries(records)
+    if args.max_queries and len(queries) > args.max_queries:
+        rng = np.random.default_rng(0)
+        queries = [queries[i] for i in sorted(rng.choice(len(queries), args.max_queries, replace=False))]
+    model_name = read_manifest()["model_name"]
+    encoder = load_encoder(model_name)
+    start = time.perf_counter()
+    embeddings = encoder.encode([embedding_text(item) for item in records])
+    print(f"📚 {len(records)} records, {len(queries)} queries, encoded in {time.perf_counter() - start:.1f}s")
+    reranker = None
+    if args.rerank:
+        reranker = Reranker(budget_ms=args.rerank_budget_ms)
+        reranker.load()
+
+    report = {"commit": git_commit(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "model_name": model_name, "encoder": encoder.backend, "records": len(records), "queries": len(queries),
+              "k": args.k, "scales": []}
+    for size in (int(scale) for scale in args.scales.split(",")):
+        print(f"⏱️ Scale {size}...")
+        report["scales"].append(benchmark_scale(records, embeddings, queries, encoder, size, k=args.k,
+                                                spec=args.index_spec, lexical=not args.no_lexical, reranker=reranker))
+    print_report(report)
+    if semantic_cache.enabled:
+        print("\n🧠 Semantic cache: " + json.dumps(semantic_cache.stats()))
+    if reranker is not None:
+        print("\n🔀 Reranker: " + json.dumps(reranker.stats()))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f))
+        for line in regressions:
+            print(f"⚠️ {line}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against " + args.compare)
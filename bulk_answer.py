@@ -0,0 +1,54 @@
+"""Answer a JSONL file of questions offline.
+
+    python bulk_answer.py questions.jsonl -o answers.jsonl
+    cat questions.jsonl | python bulk_answer.py - > answers.jsonl
+
+Each input line is {"question": "...", ...} (other keys such as an id are
+copied to the output) or a bare JSON string. Each output line adds answer,
+score, category and matched_question. Questions are read, answered and
+written one chunk at a time, with one batched encode and one index search
+per chunk, so memory stays flat however long the file is.
+"""
+import sys
+import json
+import time
+import argparse
+
+from bundle import load_bundle
+from encoders import load_encoder
+from retrieve import answer_stream, iter_question_records
+
+DEFAULT_CHUNK_SIZE = 256
+
+def bulk_answer(lines, out, model, corpus, index, chunk_size=DEFAULT_CHUNK_SIZE, threshold=0.20, progress_every=10):
+    """Write an answer line to `out` for every question line; returns (count, seconds)"""
+    start = time.perf_counter()
+    count = 0
+    for row in answer_stream(iter_question_records(lines), model, corpus, index, chunk_size, threshold):
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+        if progress_every and count % (chunk_size * progress_every) == 0:
+            elapsed = time.perf_counter() - start
+            print(f"… {count} answered ({count / elapsed:.0f} questions/s)", file=sys.stderr)
+    return count, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the current index bundle")
+    parser.add_argument("input", help='JSONL questions, or "-" for stdin')
+    parser.add_argument("-o", "--output", help="answers JSONL (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="questions per batched encode + search")
+    parser.add_argument("--threshold", type=float, default=0.20, help="minimum cosine for an answer (else the fallback)")
+    args = parser.parse_args()
+
+    bundle = load_bundle()
+    model = load_encoder(bundle.model_name, bundle=bundle)
+    source = sys.stdin if args.input == "-" else open(args.input, 'r', encoding='utf-8')
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        count, seconds = bulk_answer(source, out, model, bundle.corpus, bundle.index, args.chunk_size, args.threshold)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"✅ Answered {count} questions in {seconds:.2f}s ({count / seconds if seconds else 0:.0f} questions/s)", file=sys.stderr)
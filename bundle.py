@@ -0,0 +1,197 @@
+"""Versioned on-disk index bundle.
+
+A bundle is a directory holding everything the apps need to serve search:
+
+    manifest.json          format/content version, model name, dimension, hashes
+    embeddings.npy         (passages, dim) float32/float16 matrix, loadable with mmap
+    index.faiss            FAISS index over the same passages (Flat/HNSW/IVF-PQ/SQ, see
+                           manifest index_spec and search_params), read with mmap
+    question.bin/.idx.npy  UTF-8 text column + int64 offsets (n + 1), see corpus_store.py
+    answer.bin/.idx.npy
+    last_updated.bin/.idx.npy
+    category.npy           int16 codes into manifest["categories"]
+    priority.npy           int8 codes into manifest["priorities"] (-1 = unset)
+    tags.npy/tags.idx.npy  int32 codes into manifest["tags"], CSR offsets per row
+    parent.npy             int32 corpus row of each embedded passage (see chunking.py)
+    row_hash.npy           16-byte content hash of each passage's embedded text
+    dup_*.npy              passages of near-duplicate records dropped at build time (hash, question
+                           hash, embedding), kept only so the next incremental build can reuse them
+    bm25_*                 lexical.LexicalIndex inverted index (vocab, postings, weights)
+    meta_*                 metadata.MetadataIndex category/tag bitmaps, priority ranks, date ordinals
+
+Nothing is pickled, and loading only maps files, so every process on a host
+shares the same pages.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import faiss
+from lexical import LexicalIndex
+from metadata import MetadataIndex
+from retrieve import load_index, PassageIndex
+from corpus_store import CorpusStore
+
+BUNDLE_DIR = "index_bundle"
+FORMAT_VERSION = 1
+# Embedding rows copied at a time when adding them to an index or writing embeddings.npy
+ROW_BLOCK = 65536
+
+def embedding_text(item):
+    """The text that gets embedded for a Q&A record"""
+    return item["question"] + " " + item["answer"]
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()[:16]
+
+def row_hash(item):
+    return text_hash(embedding_text(item))
+
+def iter_row_blocks(matrix, rows=None, block_rows=ROW_BLOCK):
+    """Contiguous float32 blocks of `matrix` (of its `rows`, in order, if given), so a mapped matrix is never copied whole"""
+    n_rows = len(matrix) if rows is None else len(rows)
+    for start in range(0, n_rows, block_rows):
+        block = matrix[start:start + block_rows] if rows is None else matrix[rows[start:start + block_rows]]
+        yield np.ascontiguousarray(block, dtype=np.float32)
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_bundle(corpus, embeddings, index=None, path=BUNDLE_DIR, model_name="all-MiniLM-L6-v2", dtype="float32", keywords=(),
+                 index_spec="Flat", search_params=None, parents=None, passage_hashes=None, rows=None, duplicates=None):
+    """Write a complete bundle to a temporary directory and swap it into place.
+
+    Without `parents` every corpus row is embedded as one passage; otherwise
+    `parents[i]` is the corpus row of embedding i and `passage_hashes[i]` the
+    hash of its text. With `rows`, embedding i is `embeddings[rows[i]]`, so a
+    mapped matrix can be written without first copying the selected rows.
+    `duplicates` ({"hash", "question_hash", "embeddings"} arrays of the
+    passages dropped as near-duplicates) is stored alongside but not indexed.
+    """
+    n_passages = len(embeddings) if rows is None else len(rows)
+    dim = embeddings.shape[1]
+    if parents is None:
+        parents = np.arange(len(corpus))
+        passage_hashes = [row_hash(item) for item in corpus]
+    if len(parents) != n_passages or len(passage_hashes) != n_passages:
+        raise ValueError(f"{len(parents)} passages but there are {n_passages} embeddings")
+    if index is None:
+        index = faiss.IndexFlatIP(dim)
+        for block in iter_row_blocks(embeddings, rows):
+            index.add(block)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    # Written block by block into the mapped .npy rather than converted in memory
+    out = np.lib.format.open_memmap(os.path.join(tmp_path, "embeddings.npy"), mode='w+', dtype=dtype, shape=(n_passages, dim))
+    written = 0
+    for block in iter_row_blocks(embeddings, rows):
+        out[written:written + len(block)] = block
+        written += len(block)
+    out.flush()
+    del out
+    np.save(os.path.join(tmp_path, "row_hash.npy"), np.array(passage_hashes, dtype="S16"))
+    np.save(os.path.join(tmp_path, "parent.npy"), np.asarray(parents, dtype=np.int32))
+    if duplicates is not None:
+        np.save(os.path.join(tmp_path, "dup_hash.npy"), np.asarray(duplicates["hash"], dtype="S16"))
+        np.save(os.path.join(tmp_path, "dup_question_hash.npy"), np.asarray(duplicates["question_hash"], dtype="S16"))
+        np.save(os.path.join(tmp_path, "dup_embeddings.npy"), np.asarray(duplicates["embeddings"], dtype=dtype))
+    faiss.write_index(index, os.path.join(tmp_path, "index.faiss"))
+    store = corpus if isinstance(corpus, CorpusStore) else CorpusStore.from_records(corpus)
+    store.save(tmp_path)
+    LexicalIndex.build(corpus, keywords).save(tmp_path)
+    MetadataIndex.build(corpus).save(tmp_path)
+
+    files = {name: _file_hash(os.path.join(tmp_path, name)) for name in sorted(os.listdir(tmp_path))}
+    # Index type and search knobs are part of the version so changing them triggers a reload
+    versioned = {"files": files, "index_spec": index_spec, "search_params": search_params or {}}
+    content_hash = hashlib.sha256(json.dumps(versioned, sort_keys=True).encode('utf-8')).hexdigest()
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": content_hash[:12],
+        "content_hash": content_hash,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "model_name": model_name,
+        "dim": int(dim),
+        "count": len(corpus),
+        "passages": len(parents),
+        "dtype": dtype,
+        "index_spec": index_spec,
+        "search_params": search_params or {},
+        "categories": store.categories,
+        "priorities": store.priorities,
+        "tags": store.tags,
+        "files": files,
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap directories so readers never see a half-written bundle
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+def read_manifest(path=BUNDLE_DIR):
+    with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class BundleCorpus(CorpusStore):
+    """The bundle's corpus columns, mapped read-only and decoded lazily per row"""
+
+    __slots__ = ()
+
+class Bundle:
+    """A loaded bundle: manifest, mmapped embeddings and index, and the lazy corpus"""
+
+    def __init__(self, path=BUNDLE_DIR, mmap=True):
+        self.path = path
+        self.manifest = read_manifest(path)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format {self.manifest.get('format_version')} in {path}")
+        self.version = self.manifest["version"]
+        self.model_name = self.manifest["model_name"]
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+        self.row_hashes = np.load(os.path.join(path, "row_hash.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+        self.index = load_index(os.path.join(path, "index.faiss"), mmap=mmap, search_params=self.manifest.get("search_params"))
+        self.corpus = BundleCorpus.open(path, self.manifest)
+        self.parents = np.load(os.path.join(path, "parent.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+        chunked = len(self.parents) != len(self.corpus) or np.any(self.parents != np.arange(len(self.corpus)))
+        if chunked:
+            # Passage hits come back as corpus rows
+            self.index = PassageIndex(self.index, self.parents)
+        # Bundles written before the lexical index existed serve dense-only
+        self.lexical = LexicalIndex.load(path, len(self.corpus)) if os.path.exists(os.path.join(path, "bm25_vocab.txt")) else None
+        # Older bundles get their metadata index built from the columns at load
+        if os.path.exists(os.path.join(path, "meta_labels.json")):
+            self.metadata = MetadataIndex.load(path)
+        else:
+            self.metadata = MetadataIndex.build(self.corpus)
+        # Index row ids of each category, as used by retrieve.search_by_category
+        codes = np.asarray(self.corpus.category_codes)
+        if chunked:
+            # Selectors filter passages, so the ids are passage ids
+            codes = codes[self.parents]
+        self.category_ids = {category: np.flatnonzero(codes == code).astype(np.int64)
+                             for code, category in enumerate(self.corpus.categories)}
+
+    def close(self):
+        """Release the mapped files; only call once no query is using this bundle"""
+        self.corpus.close()
+        self.index = None
+        self.embeddings = None
+        self.lexical = None
+        self.metadata = None
+
+def load_bundle(path=BUNDLE_DIR, mmap=True):
+    return Bundle(path, mmap=mmap)
@@ -0,0 +1,92 @@
+"""Streaming passage ingestion for long answers and raw documents.
+
+MiniLM only reads the first 256 word pieces of a text, so long answers and
+handbook-length documents are split into overlapping word windows before
+embedding. Every passage remembers the corpus row (parent) it came from, and
+retrieve.PassageIndex folds passage hits back into parent rows at query time.
+
+Everything here is a generator: source files are read line by line and only
+one record or document section is held in memory at a time.
+"""
+import os
+import re
+import json
+
+# About 200-230 word pieces, safely under MiniLM's 256-token limit
+PASSAGE_WORDS = 160
+OVERLAP_WORDS = 40
+# Raw documents are grouped into records of roughly this size before passage splitting
+SECTION_WORDS = 400
+
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*$")
+
+def iter_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def split_passages(text, max_words=PASSAGE_WORDS, overlap=OVERLAP_WORDS):
+    """Yield overlapping word windows of `text`, ending on a sentence boundary where one is close"""
+    words = text.split()
+    if len(words) <= max_words:
+        yield text
+        return
+    start = 0
+    while start < len(words):
+        end = min(start + max_words, len(words))
+        if end < len(words):
+            # Back up to the last sentence end in the final quarter of the window
+            for cut in range(end, start + (3 * max_words) // 4, -1):
+                if SENTENCE_END_RE.search(words[cut - 1]):
+                    end = cut
+                    break
+        yield " ".join(words[start:end])
+        if end == len(words):
+            return
+        start = max(end - overlap, start + 1)
+
+def iter_passages(records, max_words=PASSAGE_WORDS, overlap=OVERLAP_WORDS):
+    """Yield (parent row, passage text) for each record; long answers become several passages.
+
+    Each passage is prefixed with its question so it embeds in context. A
+    record that fits in one passage yields exactly bundle.embedding_text(record).
+    """
+    for parent, item in enumerate(records):
+        question = item["question"]
+        budget = max(max_words - len(question.split()), max_words // 2)
+        for passage in split_passages(item["answer"], budget, min(overlap, budget // 2)):
+            yield parent, question + " " + passage
+
+def iter_document_records(path, title=None, section_words=SECTION_WORDS, category=None):
+    """Stream a plain-text document into Q&A-shaped records of about `section_words` words.
+
+    Paragraphs (blank-line separated) are kept together where possible. Each
+    record is titled with the document title and the section's first line, so
+    it reads as a heading in search results. Without a `category`,
+    embed_index.assign_category picks one from the heading.
+    """
+    title = title or os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+    section, size, part = [], 0, 1
+
+    def make_record(lines, part):
+        heading = lines[0] if len(lines[0].split()) <= 12 else f"part {part}"
+        return {"question": f"{title}: {heading}", "answer": " ".join(lines),
+                "category": category, "source": os.path.basename(path)}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                # Paragraph break: a good place to close a full section
+                if size >= section_words:
+                    yield make_record(section, part)
+                    section, size, part = [], 0, part + 1
+                continue
+            section.append(line)
+            size += len(line.split())
+            if size >= 2 * section_words:
+                yield make_record(section, part)
+                section, size, part = [], 0, part + 1
+    if section:
+        yield make_record(section, part)
@@ -0,0 +1,259 @@
+"""Compact columnar corpus store.
+
+A list of Q&A dicts (as pickled in the legacy corpus.pkl) costs a dict, a
+tag list and a str object per field for every record, several times the raw
+text. CorpusStore keeps:
+
+    text columns   one contiguous UTF-8 buffer + int64 offsets (n + 1) each
+    category       int16 codes into a sorted vocabulary
+    priority       int8 codes (-1 = unset)
+    tags           int32 codes with CSR offsets per row
+
+Strings are decoded only for the rows that are read, so search results
+decode just the hits they return. The index bundle stores the same layout on
+disk: bundle.BundleCorpus maps it, CorpusStore.from_records (or a
+CorpusStoreBuilder fed one record at a time) builds it in memory, e.g. from
+corpus.pkl or while embed_index.py streams the corpus.
+
+`python corpus_store.py` compares the memory of the store with the list of
+dicts it replaces for the bundle (or `--pickle corpus.pkl`).
+"""
+import os
+import sys
+import json
+import mmap
+import pickle
+import argparse
+from array import array
+import numpy as np
+from retrieve import CorpusColumns
+
+TEXT_COLUMNS = ("question", "answer", "last_updated")
+
+class TextColumn:
+    """Offset-indexed UTF-8 column over a bytes buffer or a read-only file mapping"""
+
+    __slots__ = ("offsets", "_buffer")
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def open(cls, path, name):
+        offsets = np.load(os.path.join(path, f"{name}.idx.npy"), mmap_mode='r')
+        with open(os.path.join(path, f"{name}.bin"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        return cls(buffer, offsets)
+
+    def save(self, path, name):
+        with open(os.path.join(path, f"{name}.bin"), 'wb') as f:
+            f.write(self._buffer)
+        np.save(os.path.join(path, f"{name}.idx.npy"), np.asarray(self.offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self._buffer[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    @property
+    def nbytes(self):
+        return len(self._buffer) + self.offsets.nbytes
+
+    @property
+    def mapped(self):
+        return isinstance(self._buffer, mmap.mmap)
+
+    def close(self):
+        if self.mapped:
+            self._buffer.close()
+
+def _sorted_codes(codes, seen, dtype):
+    """Renumber int64 first-seen codes (`seen` maps value -> code) into a sorted vocabulary; -1 stays unset"""
+    vocabulary = sorted(seen)
+    remap = np.zeros(len(seen) + 1, dtype=np.int64)
+    for rank, value in enumerate(vocabulary):
+        remap[seen[value]] = rank
+    remap[-1] = -1
+    return remap[np.frombuffer(codes, dtype=np.int64)].astype(dtype), vocabulary
+
+class CorpusStoreBuilder:
+    """Packs records into CorpusStore columns one at a time, so a stream of records is never held as dicts"""
+
+    def __init__(self):
+        self.buffers = {column: bytearray() for column in TEXT_COLUMNS}
+        self.offsets = {column: array('q', [0]) for column in TEXT_COLUMNS}
+        self.category_codes = array('q')
+        self.priority_codes = array('q')
+        self.tag_codes = array('q')
+        self.tag_offsets = array('q', [0])
+        self._categories, self._priorities, self._tags = {}, {}, {}
+
+    def add(self, item):
+        for column in TEXT_COLUMNS:
+            self.buffers[column] += (item.get(column) or "").encode('utf-8')
+            self.offsets[column].append(len(self.buffers[column]))
+        self.category_codes.append(self._categories.setdefault(item.get("category") or "General", len(self._categories)))
+        priority = item.get("priority")
+        self.priority_codes.append(self._priorities.setdefault(priority, len(self._priorities)) if priority else -1)
+        for tag in item.get("tags", []):
+            self.tag_codes.append(self._tags.setdefault(tag, len(self._tags)))
+        self.tag_offsets.append(len(self.tag_codes))
+
+    def __len__(self):
+        return len(self.category_codes)
+
+    def build(self):
+        """The store, with sorted vocabularies as in the bundle layout"""
+        columns = {column: TextColumn(self.buffers[column], np.frombuffer(self.offsets[column], dtype=np.int64))
+                   for column in TEXT_COLUMNS}
+        category_codes, categories = _sorted_codes(self.category_codes, self._categories, np.int16)
+        priority_codes, priorities = _sorted_codes(self.priority_codes, self._priorities, np.int8)
+        tag_codes, tags = _sorted_codes(self.tag_codes, self._tags, np.int32)
+        return CorpusStore(columns, category_codes, categories, priority_codes, priorities, tag_codes,
+                           np.frombuffer(self.tag_offsets, dtype=np.int64), tags)
+
+class CorpusStore:
+    """Sequence of Q&A records in columnar form; a record dict is built only when a row is read"""
+
+    __slots__ = ("columns", "category_codes", "categories", "priority_codes", "priorities", "tag_codes", "tag_offsets",
+                 "tags", "column_view")
+
+    def __init__(self, columns, category_codes, categories, priority_codes, priorities, tag_codes, tag_offsets, tags):
+        self.columns = columns
+        self.category_codes = category_codes
+        self.categories = list(categories)
+        self.priority_codes = priority_codes
+        self.priorities = list(priorities)
+        self.tag_codes = tag_codes
+        self.tag_offsets = tag_offsets
+        self.tags = list(tags)
+        # Search results are assembled from these columns (see retrieve.CorpusColumns)
+        self.column_view = CorpusColumns(columns["question"], columns["answer"], category_codes, self.categories,
+                                         priority_codes, self.priorities)
+
+    @classmethod
+    def from_records(cls, records):
+        """Pack an iterable of record dicts, reading it once"""
+        builder = CorpusStoreBuilder()
+        for item in records:
+            builder.add(item)
+        return builder.build()
+
+    @classmethod
+    def open(cls, path, manifest):
+        """Map the columns of a bundle directory; vocabularies come from its manifest"""
+        return cls({column: TextColumn.open(path, column) for column in TEXT_COLUMNS},
+                   np.load(os.path.join(path, "category.npy"), mmap_mode='r'), manifest["categories"],
+                   np.load(os.path.join(path, "priority.npy"), mmap_mode='r'), manifest["priorities"],
+                   np.load(os.path.join(path, "tags.npy"), mmap_mode='r'),
+                   np.load(os.path.join(path, "tags.idx.npy"), mmap_mode='r'), manifest["tags"])
+
+    def save(self, path):
+        """Write the columns and codes in the bundle layout (vocabularies go in the manifest)"""
+        for name, column in self.columns.items():
+            column.save(path, name)
+        np.save(os.path.join(path, "category.npy"), np.asarray(self.category_codes, dtype=np.int16))
+        np.save(os.path.join(path, "priority.npy"), np.asarray(self.priority_codes, dtype=np.int8))
+        np.save(os.path.join(path, "tags.npy"), np.asarray(self.tag_codes, dtype=np.int32))
+        np.save(os.path.join(path, "tags.idx.npy"), np.asarray(self.tag_offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.category_codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        item = {
+            "question": self.columns["question"][i],
+            "answer": self.columns["answer"][i],
+            "category": self.categories[self.category_codes[i]],
+            "tags": [self.tags[code] for code in self.tag_codes[self.tag_offsets[i]:self.tag_offsets[i + 1]]],
+        }
+        if self.priority_codes[i] >= 0:
+            item["priority"] = self.priorities[self.priority_codes[i]]
+        last_updated = self.columns["last_updated"][i]
+        if last_updated:
+            item["last_updated"] = last_updated
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+    def memory_usage(self):
+        """Bytes held by the store: text buffers and offsets, code arrays and vocabularies.
+
+        Mapped columns are file-backed pages shared by every process on the
+        host; `mapped` counts them separately from private heap memory.
+        """
+        text = sum(column.nbytes for column in self.columns.values())
+        mapped = sum(column.nbytes for column in self.columns.values() if column.mapped)
+        codes = sum(np.asarray(array).nbytes for array in (self.category_codes, self.priority_codes, self.tag_codes,
+                                                           self.tag_offsets))
+        vocabulary = sum(sys.getsizeof(value) for value in (*self.categories, *self.priorities, *self.tags))
+        return {"text": text, "codes": codes, "vocabulary": vocabulary, "mapped": mapped, "total": text + codes + vocabulary}
+
+def load_pickled_corpus(corpus_file="corpus.pkl"):
+    """A legacy corpus.pkl as a CorpusStore; the record dicts are freed once converted"""
+    with open(corpus_file, 'rb') as f:
+        return CorpusStore.from_records(pickle.load(f))
+
+def records_nbytes(records):
+    """Deep size of a list of record dicts: the list, every dict, key, value and tag list (shared objects once)"""
+    seen = set()
+    total = sys.getsizeof(records)
+
+    def add(obj):
+        nonlocal total
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            total += sys.getsizeof(obj)
+
+    for item in records:
+        add(item)
+        for key, value in item.items():
+            add(key)
+            add(value)
+            if isinstance(value, list):
+                for element in value:
+                    add(element)
+    return total
+
+def memory_report(records, store):
+    """Memory of the list of dicts against the store holding the same records"""
+    raw = sum(len((item.get(column) or "").encode('utf-8')) for item in records for column in TEXT_COLUMNS)
+    dicts = records_nbytes(records)
+    usage = store.memory_usage()
+    return {"records": len(records), "raw_text_bytes": raw, "dict_bytes": dicts, "store_bytes": usage,
+            "dict_overhead": dicts / raw if raw else None, "store_overhead": usage["total"] / raw if raw else None,
+            "saving": 1 - usage["total"] / dicts if dicts else None}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory of a list-of-dicts corpus with the compact store")
+    parser.add_argument("--pickle", metavar="CORPUS_PKL", help="legacy corpus.pkl instead of the index bundle")
+    parser.add_argument("--bundle", default="index_bundle", help="bundle directory")
+    args = parser.parse_args()
+
+    report = {}
+    if args.pickle:
+        with open(args.pickle, 'rb') as f:
+            records = pickle.load(f)
+    else:
+        from bundle import read_manifest
+
+        mapped = CorpusStore.open(args.bundle, read_manifest(args.bundle))
+        records = list(mapped)
+        report["mapped"] = memory_report(records, mapped)
+    report["in_memory"] = memory_report(records, CorpusStore.from_records(records))
+    print(json.dumps(report, indent=2))
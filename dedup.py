@@ -0,0 +1,106 @@
+"""Near-duplicate detection for the merged Q&A corpora.
+
+enhanced_corpus.jsonl and qna_corpus.jsonl repeat many questions, often with
+only punctuation or wording changes. embed_index.py merges both and then
+clusters records whose embeddings have a cosine of at least DEDUP_THRESHOLD.
+Similar pairs come from batched FAISS range searches, and clusters are the
+connected components of those pairs, found by vectorized label propagation.
+Each cluster keeps its record with the richest metadata. A JSON report lists
+every merge so it can be reviewed.
+"""
+import json
+import time
+import numpy as np
+import faiss
+
+CORPUS_FILES = ("enhanced_corpus.jsonl", "qna_corpus.jsonl")
+DEDUP_THRESHOLD = 0.95
+DEDUP_REPORT = "dedup_report.json"
+RANGE_BATCH = 4096
+
+def richness(item):
+    """Sort key: records with more metadata (then longer answers) are kept over their duplicates"""
+    fields = sum(1 for field in ("category", "priority", "last_updated") if item.get(field))
+    return (fields + bool(item.get("tags")), len(item.get("tags", [])), len(item["answer"]))
+
+def _batches(embeddings, rows, batch_size):
+    n_rows = len(embeddings) if rows is None else len(rows)
+    for start in range(0, n_rows, batch_size):
+        batch = embeddings[start:start + batch_size] if rows is None else embeddings[rows[start:start + batch_size]]
+        yield start, np.ascontiguousarray(batch, dtype=np.float32)
+
+def similar_pairs(embeddings, threshold=DEDUP_THRESHOLD, batch_size=RANGE_BATCH, rows=None):
+    """(i, j, cosine) arrays of every pair i < j whose unit embeddings have cosine >= threshold.
+
+    With `rows`, item i is `embeddings[rows[i]]`; vectors are read a batch at a time either way.
+    """
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    for _, batch in _batches(embeddings, rows, batch_size):
+        index.add(batch)
+    firsts, seconds, cosines = [], [], []
+    for start, batch in _batches(embeddings, rows, batch_size):
+        lims, sims, ids = index.range_search(batch, threshold)
+        # Item each hit was found for, one entry per hit
+        query_items = np.repeat(np.arange(start, start + len(lims) - 1), np.diff(lims.astype(np.int64)))
+        later = ids > query_items
+        firsts.append(query_items[later])
+        seconds.append(ids[later])
+        cosines.append(sims[later])
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(firsts), np.concatenate(seconds).astype(np.int64), np.concatenate(cosines)
+
+def connected_components(n, firsts, seconds):
+    """Component label (its smallest member) of each of n nodes linked by the given edges"""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[firsts], labels[seconds])
+        updated = labels.copy()
+        np.minimum.at(updated, firsts, low)
+        np.minimum.at(updated, seconds, low)
+        # Pointer jumping: follow each label to its own label
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def find_duplicates(corpus, embeddings, threshold=DEDUP_THRESHOLD, rows=None):
+    """Rows to keep (sorted) and the merged clusters as [(kept row, [(dropped row, cosine to kept)])].
+
+    Record i is represented by `embeddings[i]`, or by `embeddings[rows[i]]` when `rows` is given.
+    """
+    firsts, seconds, _ = similar_pairs(embeddings, threshold, rows=rows)
+    labels = connected_components(len(corpus), firsts, seconds)
+    order = np.argsort(labels, kind="stable")
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    keep = np.ones(len(corpus), dtype=bool)
+    at = np.arange(len(corpus)) if rows is None else np.asarray(rows)
+    clusters = []
+    for members in np.split(order, starts[1:]):
+        if len(members) < 2:
+            continue
+        # max() keeps the earliest row among equally rich ones, i.e. the first corpus file wins
+        kept = max(members.tolist(), key=lambda row: (richness(corpus[row]), -row))
+        dropped = [row for row in members.tolist() if row != kept]
+        keep[dropped] = False
+        cosines = np.asarray(embeddings[at[dropped]], dtype=np.float32) @ np.asarray(embeddings[at[kept]], dtype=np.float32)
+        clusters.append((kept, list(zip(dropped, cosines.tolist()))))
+    return np.flatnonzero(keep), clusters
+
+def dedup_report(corpus, sources, clusters, threshold, path=DEDUP_REPORT):
+    """Write the merges as JSON for review; returns the report"""
+    def describe(row):
+        return {"question": corpus[row]["question"], "source": sources[row]}
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "threshold": threshold,
+        "input_records": len(corpus),
+        "kept_records": len(corpus) - sum(len(dropped) for _, dropped in clusters),
+        "clusters": [{"kept": describe(kept),
+                      "dropped": [{**describe(row), "cosine": round(cosine, 4)} for row, cosine in dropped]}
+                     for kept, dropped in sorted(clusters, key=lambda cluster: -len(cluster[1]))],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
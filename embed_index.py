@@ -1,35 +1,483 @@
+import os
+import sys
+import argparse
 import json
+import time
 import pickle
+import shutil
+import itertools
+import collections
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from bundle import write_bundle, read_manifest, text_hash, iter_row_blocks, BUNDLE_DIR
+from corpus_store import CorpusStore, CorpusStoreBuilder, TextColumn
+from chunking import iter_jsonl, iter_passages, iter_document_records
+from lexical import load_keywords
+from dedup import find_duplicates, dedup_report, CORPUS_FILES, DEDUP_THRESHOLD, DEDUP_REPORT
 
 MODEL_NAME = "all-MiniLM-L6-v2"
 
+# Runtime knobs stored in the bundle manifest; only those that apply to the index type are kept
+DEFAULT_SEARCH_PARAMS = {"nprobe": 16, "efSearch": 64}
+MAX_TRAINING_ROWS = 100_000
+# Passages are streamed through the encoder this many at a time; each encoded chunk is checkpointed
+ENCODE_CHUNK_PASSAGES = 8192
+ENCODE_BATCH_SIZE = 64
+
 def load_corpus(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return [json.loads(line) for line in f]
 
-def create_faiss_index(corpus, index_file="faiss_index.bin", corpus_file="corpus.pkl"):
-    model = SentenceTransformer(MODEL_NAME)
+def assign_category(item):
+    """Keep a pre-defined category, otherwise fall back to keyword matching on the question"""
+    if item.get("category"):
+        return item["category"]
+    
+    question_lower = item["question"].lower()
+    if any(word in question_lower for word in ["emergency", "safety", "crisis", "threat", "evacuation"]):
+        return "Emergency & Safety"
+    elif any(word in question_lower for word in ["ferpa", "legal", "compliance", "privacy", "title ix"]):
+        return "Legal & Compliance"
+    elif any(word in question_lower for word in ["grant", "funding", "innovation", "educational"]):
+        return "Grants & Funding"
+    elif any(word in question_lower for word in ["student", "mental health", "counseling", "wellbeing"]):
+        return "Student Support"
+    elif any(word in question_lower for word in ["accessibility", "digital", "wcag", "inclusive"]):
+        return "Accessibility & Inclusion"
+    elif any(word in question_lower for word in ["feedback", "survey", "evaluation", "reflection"]):
+        return "Teaching Improvement"
+    elif any(word in question_lower for word in ["syllabus", "course", "teaching", "classroom"]):
+        return "Teaching Resources"
+    return "General"
+
+class PreviousEmbeddings:
+    """Passage embeddings of the current bundle, looked up by the hash of their text.
+
+    Covers the indexed passages and the near-duplicates dropped from the
+    index (bundle dup_*.npy), so neither is re-encoded by the next build. The
+    vectors stay in the bundle's mapped files; only the sorted 16-byte
+    passage hashes are held in memory. Built empty when there is no usable
+    bundle, so nothing is found.
+    """
+
+    def __init__(self, bundle_dir=None, hashes=None, matrices=()):
+        self.bundle_dir = bundle_dir
+        self.hashes = np.zeros(0, dtype="S16") if hashes is None else hashes
+        # Rows past the end of the first matrix continue in the next one
+        self.matrices = list(matrices)
+        self._order = np.argsort(self.hashes, kind="stable")
+        self._sorted = self.hashes[self._order]
+
+    @classmethod
+    def load(cls, bundle_dir=BUNDLE_DIR):
+        """The current bundle's embeddings if it was built with the same model, else an empty instance"""
+        try:
+            manifest = read_manifest(bundle_dir)
+            matrices = [np.load(os.path.join(bundle_dir, "embeddings.npy"), mmap_mode='r')]
+            hashes = [np.load(os.path.join(bundle_dir, "row_hash.npy"))]
+        except FileNotFoundError:
+            return cls()
+        if manifest["model_name"] != MODEL_NAME:
+            print(f"⚠️ Existing bundle was built with {manifest['model_name']}; re-encoding everything")
+            return cls()
+        if os.path.exists(os.path.join(bundle_dir, "dup_hash.npy")):
+            matrices.append(np.load(os.path.join(bundle_dir, "dup_embeddings.npy"), mmap_mode='r'))
+            hashes.append(np.load(os.path.join(bundle_dir, "dup_hash.npy")))
+        return cls(bundle_dir, np.concatenate(hashes), matrices)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def find(self, hashes):
+        """Row of each hash among the previous passages, or -1 where its text is new"""
+        wanted = np.array(hashes, dtype="S16")
+        if not len(self._sorted):
+            return np.full(len(wanted), -1, dtype=np.int64)
+        at = np.minimum(np.searchsorted(self._sorted, wanted), len(self._sorted) - 1)
+        return np.where(self._sorted[at] == wanted, self._order[at], -1)
+
+    def vectors(self, rows):
+        """float32 copies of the given previous rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.matrices[0].shape[1]), dtype=np.float32)
+        offset = 0
+        for matrix in self.matrices:
+            inside = (rows >= offset) & (rows < offset + len(matrix))
+            out[inside] = matrix[rows[inside] - offset]
+            offset += len(matrix)
+        return out
+
+    def question_hashes(self):
+        """Hash of the question each previous passage belongs to; questions are decoded one at a time"""
+        questions = TextColumn.open(self.bundle_dir, "question")
+        try:
+            by_row = np.array([text_hash(questions[row]) for row in range(len(questions))], dtype="S16")
+        finally:
+            questions.close()
+        parent_file = os.path.join(self.bundle_dir, "parent.npy")
+        found = [by_row[np.load(parent_file)] if os.path.exists(parent_file) else by_row]
+        if len(self.matrices) > 1:
+            found.append(np.load(os.path.join(self.bundle_dir, "dup_question_hash.npy")))
+        return np.concatenate(found)
+
+class PassageEncoder:
+    """Encodes passage texts with the model loaded on first use.
+
+    Texts are encoded shortest-first so each batch pads to similar lengths.
+    With workers > 1 the batches are spread over a sentence-transformers
+    multi-process pool; call close() to stop it.
+    """
+
+    def __init__(self, workers=1, batch_size=ENCODE_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.model = None
+        self.pool = None
+        self.encoded = 0
+        self.seconds = 0.0
+
+    def encode(self, texts):
+        start = time.perf_counter()
+        if self.model is None:
+            # Imported here so benchmarks and no-change rebuilds never load torch
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(MODEL_NAME, device="cpu")
+            if self.workers > 1:
+                self.pool = self.model.start_multi_process_pool(["cpu"] * self.workers)
+        # Length buckets: the pool hands each worker a contiguous slice, so sort the whole chunk first
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        ordered = [texts[i] for i in order]
+        # With a pool, encode() hands each worker chunk_size texts; without one (pool=None) it runs in-process
+        chunk_size = max(self.batch_size, len(ordered) // (4 * self.workers)) if self.pool is not None else None
+        encoded = self.model.encode(ordered, batch_size=self.batch_size, normalize_embeddings=True,
+                                    pool=self.pool, chunk_size=chunk_size)
+        embeddings = np.empty_like(encoded, dtype=np.float32)
+        embeddings[order] = encoded
+        self.encoded += len(texts)
+        self.seconds += time.perf_counter() - start
+        return embeddings
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def load_checkpoint(checkpoint_dir):
+    """Map passage hash -> embedding for every chunk an interrupted build already encoded"""
+    found = {}
+    if not os.path.isdir(checkpoint_dir):
+        return found
+    for name in sorted(os.listdir(checkpoint_dir)):
+        # The hash file is written last, so its presence marks a complete part
+        if not name.endswith(".hash.npy"):
+            continue
+        hashes = np.load(os.path.join(checkpoint_dir, name))
+        vectors = np.load(os.path.join(checkpoint_dir, name.replace(".hash.npy", ".npy")), mmap_mode='r')
+        found.update((bytes(h), vectors[i]) for i, h in enumerate(hashes))
+    return found
+
+def _save_checkpoint_part(checkpoint_dir, part, hashes, vectors):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    np.save(os.path.join(checkpoint_dir, f"part-{part:05d}.npy"), vectors)
+    tmp = os.path.join(checkpoint_dir, f"part-{part:05d}.tmp.npy")
+    np.save(tmp, np.array(hashes, dtype="S16"))
+    os.replace(tmp, os.path.join(checkpoint_dir, f"part-{part:05d}.hash.npy"))
+
+def encode_passages(passages, previous, checkpoint_dir, encoder, chunk_passages=ENCODE_CHUNK_PASSAGES):
+    """Stream (parent, text) passages into an on-disk float32 matrix, encoding only text not seen before.
+
+    Embeddings come from the previous bundle (a PreviousEmbeddings), from checkpoint parts left by an
+    interrupted build, or from `encoder`; each newly encoded chunk is saved to
+    `checkpoint_dir` before moving on. Only one chunk of texts is held in
+    memory. Returns (embeddings memmap, parents, passage hashes, indices of
+    passages not in `previous`).
+    """
+    resumed = load_checkpoint(checkpoint_dir)
+    if resumed:
+        print(f"⏯️ Resuming with {len(resumed)} passages from {checkpoint_dir}/")
+    part = len([name for name in os.listdir(checkpoint_dir) if name.endswith(".hash.npy")]) if resumed else 0
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    out_file = os.path.join(checkpoint_dir, "embeddings.f32")
+
+    parents, hashes, missing = [], [], []
+    dim = None
+    passages = iter(passages)
+    with open(out_file, 'wb') as out:
+        while True:
+            chunk = list(itertools.islice(passages, chunk_passages))
+            if not chunk:
+                break
+            chunk_hashes = [text_hash(text) for _, text in chunk]
+            found = previous.find(chunk_hashes)
+            known = np.flatnonzero(found >= 0)
+            vectors = [None] * len(chunk)
+            if len(known):
+                for i, vector in zip(known.tolist(), previous.vectors(found[known])):
+                    vectors[i] = vector
+            todo = []
+            for i in np.flatnonzero(found < 0).tolist():
+                if chunk_hashes[i] in resumed:
+                    vectors[i] = resumed[chunk_hashes[i]]
+                else:
+                    todo.append(i)
+                missing.append(len(hashes) + i)
+            if todo:
+                encoded = encoder.encode([chunk[i][1] for i in todo])
+                _save_checkpoint_part(checkpoint_dir, part, [chunk_hashes[i] for i in todo], encoded)
+                part += 1
+                for i, embedding in zip(todo, encoded):
+                    vectors[i] = embedding
+            block = np.asarray(vectors, dtype=np.float32)
+            dim = block.shape[1]
+            out.write(block.tobytes())
+            parents.extend(parent for parent, _ in chunk)
+            hashes.extend(chunk_hashes)
+    if not hashes:
+        raise ValueError("Nothing to index: the corpus and documents produced no passages")
+    embeddings = np.memmap(out_file, dtype=np.float32, mode='r', shape=(len(hashes), dim))
+    return embeddings, parents, hashes, missing
+
+def resolve_index_spec(spec, n_rows):
+    """Fill in "IVFauto" with a list count suited to the corpus size (about 4 * sqrt(n), >= 39 rows per list)"""
+    if "IVFauto" in spec:
+        nlist = max(1, min(int(4 * np.sqrt(n_rows)), n_rows // 39))
+        spec = spec.replace("IVFauto", f"IVF{nlist}")
+    return spec
+
+def build_ann_index(embeddings, spec="Flat", search_params=None, rows=None):
+    """Build and train a FAISS index from a factory spec.
+    
+    Examples: "Flat" (exact), "HNSW32", "HNSW32,SQ8", "IVFauto,PQ32",
+    "IVF1024,SQ8", "SQfp16". With `rows`, only those rows of `embeddings` are
+    indexed. Vectors are added block by block, so a mapped matrix is never
+    copied whole. Returns (index, resolved spec, search params).
+    """
+    selected = np.arange(len(embeddings)) if rows is None else np.asarray(rows)
+    spec = resolve_index_spec(spec, len(selected))
+    index = faiss.index_factory(embeddings.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        sample = selected
+        if len(selected) > MAX_TRAINING_ROWS:
+            rng = np.random.default_rng(0)
+            sample = selected[rng.choice(len(selected), MAX_TRAINING_ROWS, replace=False)]
+        index.train(np.ascontiguousarray(embeddings[sample], dtype=np.float32))
+    for block in iter_row_blocks(embeddings, rows):
+        index.add(block)
+    return index, spec, apply_search_params(index, search_params)
+
+def apply_search_params(index, search_params=None):
+    """Set the default + requested search knobs on `index`; returns the ones that apply to its type"""
+    params = {}
+    space = faiss.ParameterSpace()
+    for name, value in {**DEFAULT_SEARCH_PARAMS, **(search_params or {})}.items():
+        try:
+            space.set_index_parameter(index, name, value)
+            params[name] = value
+        except RuntimeError:
+            pass  # e.g. nprobe on an HNSW index
+    return params
+
+def previous_index_spec(bundle_dir=BUNDLE_DIR):
+    try:
+        manifest = read_manifest(bundle_dir)
+    except FileNotFoundError:
+        return None, None
+    return manifest.get("index_spec"), manifest.get("search_params")
+
+def drop_duplicates(corpus, sources, embeddings, parents, hashes, threshold=DEDUP_THRESHOLD, report_path=DEDUP_REPORT):
+    """Remove near-duplicate records and their passages.
+
+    Records are compared by their first passage embedding (the whole
+    question + answer for short records). Returns the kept corpus, the rows
+    of `embeddings` that remain (None when nothing was dropped), the parents
+    and hashes of those rows, and the dropped passages as write_bundle's
+    `duplicates`. The kept embeddings are not copied; build_ann_index and
+    write_bundle read the remaining rows in blocks.
+    """
+    parents = np.asarray(parents)
+    _, first_passage = np.unique(parents, return_index=True)
+    keep, clusters = find_duplicates(corpus, embeddings, threshold, rows=first_passage)
+    if len(keep) == len(corpus):
+        return corpus, None, parents.tolist(), hashes, None
+    report = dedup_report(corpus, sources, clusters, threshold, report_path)
+    print(f"🧹 Merged {len(corpus) - len(keep)} near-duplicates into {len(clusters)} records "
+          f"(cosine ≥ {threshold}); report in {report_path}")
+
+    new_row = np.full(len(corpus), -1, dtype=np.int64)
+    new_row[keep] = np.arange(len(keep))
+    passage_keep = new_row[parents] >= 0
+    dropped = np.flatnonzero(~passage_keep)
+    duplicates = {"hash": np.array([hashes[i] for i in dropped], dtype="S16"),
+                  "question_hash": np.array([text_hash(corpus.columns["question"][parents[i]]) for i in dropped],
+                                            dtype="S16"),
+                  "embeddings": np.asarray(embeddings[dropped], dtype=np.float32)}
+    hashes = [h for h, kept in zip(hashes, passage_keep.tolist()) if kept]
+    return (CorpusStore.from_records(corpus[row] for row in keep), np.flatnonzero(passage_keep), new_row[parents[passage_keep]].tolist(), hashes,
+            duplicates)
+
+def incremental_summary(previous, corpus, parents, hashes, missing):
+    """(added, updated, deleted, unchanged) record counts against the previous bundle.
+
+    Counted on the records before dedup, so near-duplicates are compared with
+    the duplicates the previous build dropped. Records with any new passage
+    text were re-encoded; one whose question the previous bundle already had
+    counts as an update. Questions are compared by hash.
+    """
+    changed = np.unique(np.asarray(parents, dtype=np.int64)[np.asarray(missing, dtype=np.int64)])
+    old_questions = previous.question_hashes()
+    questions = corpus.columns["question"]
+    new_questions = np.array([text_hash(questions[row]) for row in range(len(questions))], dtype="S16")
+    updated = int(np.isin(new_questions[changed], old_questions).sum())
+    gone = np.isin(previous.hashes, np.array(hashes, dtype="S16"), invert=True)
+    deleted = len(np.setdiff1d(old_questions[gone], new_questions))
+    return len(changed) - updated, updated, deleted, len(corpus) - len(changed)
+
+def create_faiss_index(corpus, bundle_dir=BUNDLE_DIR, incremental=True, index_spec=None, search_params=None, documents=(),
+                       workers=1, batch_size=ENCODE_BATCH_SIZE, chunk_passages=ENCODE_CHUNK_PASSAGES, sources=None,
+                       dedup_threshold=DEDUP_THRESHOLD, dedup_report_path=DEDUP_REPORT):
+    """Build the bundle from `corpus` (an iterable of records) followed by the sections of `documents`.
+
+    `sources` names the origin of each corpus record for the dedup report.
+    Records are read once: each is categorized and packed into a
+    CorpusStoreBuilder as the passage encoder consumes it, so no list of
+    record dicts is built.
+    """
+    # Raw documents become Q&A-shaped records alongside the corpus
+    labeled = itertools.chain(zip(corpus, itertools.repeat("corpus") if sources is None else sources),
+                              ((item, path) for path in documents for item in iter_document_records(path)))
+    builder = CorpusStoreBuilder()
+    sources = []
+
+    def ingest():
+        for item, source in labeled:
+            # Categorize once at build time so the apps never have to
+            item["category"] = assign_category(item)
+            builder.add(item)
+            sources.append(source)
+            yield item
+
+    # Long answers are embedded as several passages; reuse stored embeddings for unchanged passage text
+    previous = PreviousEmbeddings.load(bundle_dir) if incremental else PreviousEmbeddings()
+    checkpoint_dir = f"{bundle_dir}.encode"
+    if not incremental:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    encoder = PassageEncoder(workers=workers, batch_size=batch_size)
+    try:
+        embeddings, parents, hashes, missing = encode_passages(iter_passages(ingest()), previous, checkpoint_dir, encoder,
+                                                               chunk_passages=chunk_passages)
+    finally:
+        encoder.close()
+    corpus = builder.build()
+    for source, count in collections.Counter(sources).items():
+        if source in documents:
+            print(f"📄 Added {count} sections from {source}")
+        else:
+            print(f"📁 Loaded {count} records from {source}")
+    if encoder.encoded:
+        print(f"🧠 Encoded {encoder.encoded} passages in {encoder.seconds:.2f}s "
+              f"({encoder.encoded / encoder.seconds:.0f}/s, {workers} worker{'s' if workers > 1 else ''})")
+    summary = incremental_summary(previous, corpus, parents, hashes, missing) if incremental and len(previous) else None
+    rows, duplicates = None, None
+    if dedup_threshold:
+        corpus, rows, parents, hashes, duplicates = drop_duplicates(corpus, sources, embeddings, parents, hashes,
+                                                                    dedup_threshold, dedup_report_path)
+    if len(hashes) > len(corpus):
+        print(f"✂️ Split {len(corpus)} records into {len(hashes)} passages")
+
+    # Keep the existing bundle's index type unless a new one is requested
+    if index_spec is None:
+        index_spec, previous_params = previous_index_spec(bundle_dir)
+        search_params = search_params or previous_params
+    start = time.perf_counter()
+    index, index_spec, search_params = build_ann_index(embeddings, index_spec or "Flat", search_params, rows=rows)
+    print(f"🗂️ Built {index_spec} index in {time.perf_counter() - start:.2f}s" + (f" {search_params}" if search_params else ""))
+
+    manifest = write_bundle(corpus, embeddings, index=index, path=bundle_dir, model_name=MODEL_NAME,
+                            keywords=load_keywords(), index_spec=index_spec, search_params=search_params,
+                            parents=parents, passage_hashes=hashes, rows=rows, duplicates=duplicates)
+    # The bundle is in place, so the encoded chunks are no longer needed to resume
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    if summary is not None:
+        print("🔁 Incremental build: {} added, {} updated, {} deleted, {} unchanged".format(*summary))
+    print(f"✅ Index bundle {manifest['version']} saved to {bundle_dir}/")
+    print_summary(corpus)
+
+def migrate_legacy(index_file="faiss_index.bin", corpus_file="corpus.pkl", bundle_dir=BUNDLE_DIR):
+    """Convert an old faiss_index.bin + corpus.pkl pair into a bundle without re-encoding"""
+    index = faiss.read_index(index_file)
+    with open(corpus_file, 'rb') as f:
+        corpus = pickle.load(f)
+    for item in corpus:
+        item["category"] = assign_category(item)
+    embeddings = index.reconstruct_n(0, index.ntotal)
+
+    manifest = write_bundle(corpus, embeddings, index=index, path=bundle_dir, model_name=MODEL_NAME, keywords=load_keywords())
+
+    print(f"✅ Migrated {index_file} + {corpus_file} to bundle {manifest['version']} in {bundle_dir}/")
+    print_summary(corpus)
+
+def benchmark_index_specs(embeddings, specs, k=10, n_queries=200, search_params=None, noise=0.05):
+    """Recall@k and per-query latency of each index spec against exact Flat search.
+    
+    Queries are corpus vectors with Gaussian noise added, standing in for
+    paraphrased questions near known answers.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)]
+    queries = queries + rng.normal(0, noise, queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    k = min(k, len(embeddings))
+    
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
     
-    # Create embeddings from question + answer text
-    texts = [item["question"] + " " + item["answer"] for item in corpus]
-    embeddings = model.encode(texts, normalize_embeddings=True)
+    report = []
+    for spec in specs:
+        start = time.perf_counter()
+        index, resolved, params = build_ann_index(embeddings, spec, search_params)
+        build_seconds = time.perf_counter() - start
+        latencies = []
+        found = np.zeros_like(truth)
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+            latencies.append(time.perf_counter() - start)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+        latencies = np.array(latencies) * 1000
+        report.append({
+            "spec": resolved,
+            "search_params": params,
+            f"recall@{k}": float(recall),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "build_s": build_seconds,
+            "size_mb": len(faiss.serialize_index(index)) / 1e6,
+        })
+    return report
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(np.array(embeddings, dtype=np.float32))
+def print_benchmark(report):
+    recall_key = next(key for key in report[0] if key.startswith("recall@"))
+    print(f"\n{'spec':<24}{recall_key:>11}{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}{'MB':>9}  params")
+    for row in report:
+        print(f"{row['spec']:<24}{row[recall_key]:>11.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}"
+              f"{row['build_s']:>9.2f}{row['size_mb']:>9.2f}  {row['search_params']}")
 
-    faiss.write_index(index, index_file)
-    with open(corpus_file, 'wb') as f:
-        pickle.dump(corpus, f)
+def synthetic_embeddings(n_rows, dim=384, n_clusters=256, seed=0):
+    """Clustered random unit vectors for benchmarking index types beyond the real corpus size"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_rows)] + rng.normal(0, 0.6, (n_rows, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
 
-    print("✅ FAISS index and corpus saved successfully.")
+def print_summary(corpus):
     print(f"📊 Indexed {len(corpus)} Q&A pairs")
     
-    # Print category statistics if available
-    if corpus and "category" in corpus[0]:
+    # Print category statistics
+    if corpus:
         categories = {}
         for item in corpus:
             cat = item.get("category", "Unknown")
@@ -40,12 +488,50 @@ def create_faiss_index(corpus, index_file="faiss_index.bin", corpus_file="corpus
             print(f"  - {cat}: {count} items")
 
 if __name__ == "__main__":
-    # Try enhanced corpus first, fall back to original
-    try:
-        corpus = load_corpus("enhanced_corpus.jsonl")
-        print("📁 Using enhanced corpus with metadata")
-    except FileNotFoundError:
-        corpus = load_corpus("qna_corpus.jsonl")
-        print("📁 Using original corpus")
+    parser = argparse.ArgumentParser(description="Build the index bundle from enhanced_corpus.jsonl (or qna_corpus.jsonl)")
+    parser.add_argument("--full", action="store_true", help="re-encode every row instead of reusing stored embeddings")
+    parser.add_argument("--from-legacy", action="store_true", help="convert faiss_index.bin + corpus.pkl without re-encoding")
+    parser.add_argument("--index-spec", help='FAISS factory spec, e.g. "Flat", "HNSW32", "HNSW32,SQ8", "IVFauto,PQ32" (default: keep current)')
+    parser.add_argument("--nprobe", type=int, help="IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, help="HNSW candidate list size per query")
+    parser.add_argument("--benchmark-index", metavar="SPECS", help='";"-separated specs to compare against exact Flat search')
+    parser.add_argument("--synthetic", type=int, metavar="ROWS", help="benchmark on this many synthetic vectors instead of the bundle")
+    parser.add_argument("--workers", type=int, default=1, help="encoder processes for large builds")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="passages per encoder batch")
+    parser.add_argument("--chunk-size", type=int, default=ENCODE_CHUNK_PASSAGES, help="passages encoded and checkpointed at a time")
+    parser.add_argument("--documents", nargs="+", default=[], metavar="PATH", help="plain-text documents to split into sections and index with the corpus")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="cosine at which records count as near-duplicates")
+    parser.add_argument("--no-dedup", action="store_true", help="index every record, duplicates included")
+    parser.add_argument("--dedup-report", default=DEDUP_REPORT, help="where to write the list of merged records")
+    args = parser.parse_args()
+    
+    search_params = {}
+    if args.nprobe:
+        search_params["nprobe"] = args.nprobe
+    if args.ef_search:
+        search_params["efSearch"] = args.ef_search
+    
+    if args.benchmark_index:
+        if args.synthetic:
+            embeddings = synthetic_embeddings(args.synthetic)
+        else:
+            embeddings = np.load(os.path.join(BUNDLE_DIR, "embeddings.npy")).astype(np.float32)
+        print(f"📏 Benchmarking on {len(embeddings)} vectors")
+        print_benchmark(benchmark_index_specs(embeddings, ["Flat"] + args.benchmark_index.split(";"), search_params=search_params))
+        sys.exit(0)
+    
+    if args.from_legacy:
+        migrate_legacy()
+        sys.exit(0)
+    
+    # Both corpora are merged; the enhanced one comes first so its metadata wins among duplicates
+    labeled = ((item, path) for path in CORPUS_FILES if os.path.exists(path) for item in iter_jsonl(path))
+    # Read in lockstep by create_faiss_index, so the tee buffers at most one record
+    records, paths = itertools.tee(labeled)
+    corpus, sources = (item for item, _ in records), (path for _, path in paths)
     
-    create_faiss_index(corpus)
+    # Only new or edited rows are encoded unless --full is given
+    create_faiss_index(corpus, incremental=not args.full, index_spec=args.index_spec, search_params=search_params or None,
+                       documents=args.documents, workers=args.workers, batch_size=args.batch_size,
+                       chunk_passages=args.chunk_size, sources=sources,
+                       dedup_threshold=None if args.no_dedup else args.dedup_threshold, dedup_report_path=args.dedup_report)
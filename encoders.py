@@ -0,0 +1,207 @@
+"""Query encoder backends.
+
+ENCODER_BACKEND selects how queries are embedded at serve time:
+
+    torch   the reference sentence-transformers PyTorch model (fp32)
+    onnx    the same weights exported to ONNX Runtime
+    int8    the ONNX export with dynamic int8 quantization
+
+The onnx and int8 backends need `optimum[onnxruntime]` and
+sentence-transformers >= 3.2. Exports are cached under ENCODER_DIR. Before a
+non-reference backend serves, it must reproduce the embeddings stored in the
+index bundle (which embed_index.py built with the torch model) to within
+ENCODER_MIN_COSINE. Otherwise the apps fall back to torch.
+"""
+import os
+import time
+import threading
+import numpy as np
+
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ENCODER_DIR = os.environ.get("ENCODER_DIR", "encoder_models")
+# avx2 runs on any recent x86 CPU; use avx512_vnni or arm64 where available
+INT8_CONFIG = os.environ.get("ENCODER_INT8_CONFIG", "avx2")
+ENCODER_MIN_COSINE = float(os.environ.get("ENCODER_MIN_COSINE", "0.98"))
+PARITY_SAMPLES = 64
+BACKENDS = ("torch", "onnx", "int8")
+
+class EncoderParityError(ValueError):
+    pass
+
+class Encoder:
+    """One `encode(texts)` interface over every backend: (n, dim) float32 unit vectors"""
+
+    def __init__(self, model, backend, model_name):
+        self.model = model
+        self.backend = backend
+        self.model_name = model_name
+        self.parity = None
+
+    def encode(self, texts, batch_size=32):
+        embeddings = self.model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def stats(self):
+        return {"backend": self.backend, "model_name": self.model_name, "parity": self.parity}
+
+def _load_model(model_name, backend, cache_dir):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+    path = os.path.join(cache_dir, model_name.replace("/", "__"))
+    onnx_file = os.path.join(path, "onnx", "model.onnx")
+    int8_file = f"onnx/model_qint8_{INT8_CONFIG}.onnx"
+    if not os.path.exists(onnx_file):
+        # First use exports the weights; later processes load the saved graph
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        model.save(path)
+    if backend == "onnx":
+        return SentenceTransformer(path, device="cpu", backend="onnx")
+    if not os.path.exists(os.path.join(path, int8_file)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        export_dynamic_quantized_onnx_model(SentenceTransformer(path, device="cpu", backend="onnx"),
+                                            quantization_config=INT8_CONFIG, model_name_or_path=path)
+    return SentenceTransformer(path, device="cpu", backend="onnx", model_kwargs={"file_name": int8_file})
+
+def reference_sample(bundle, n=PARITY_SAMPLES):
+    """(texts, stored embeddings) for up to n bundle rows embedded as a single passage"""
+    from bundle import embedding_text
+
+    parents = np.asarray(bundle.parents)
+    single = np.flatnonzero(np.bincount(parents)[parents] == 1)
+    if len(single) > n:
+        single = single[np.linspace(0, len(single) - 1, n).astype(np.int64)]
+    texts = [embedding_text(bundle.corpus[int(parents[i])]) for i in single]
+    return texts, np.asarray(bundle.embeddings[single], dtype=np.float32)
+
+def check_parity(encoder, texts, reference, min_cosine=ENCODER_MIN_COSINE):
+    """Cosine agreement of `encoder` with reference embeddings; raises EncoderParityError below min_cosine"""
+    embeddings = encoder.encode(texts)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cosines = np.sum(embeddings * reference, axis=1)
+    report = {"samples": len(texts), "min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+    if report["min_cosine"] < min_cosine:
+        raise EncoderParityError(f"{encoder.backend} encoder min cosine {report['min_cosine']:.4f} "
+                                 f"< {min_cosine} against {len(texts)} reference embeddings")
+    return report
+
+def load_encoder(model_name, backend=ENCODER_BACKEND, bundle=None, cache_dir=ENCODER_DIR, fallback=True):
+    """Load the query encoder for `backend`.
+
+    Given a bundle, an accelerated backend is checked against its stored
+    embeddings first. If it fails the check (or cannot be loaded) it is
+    replaced by the torch reference when `fallback` is set.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    start = time.perf_counter()
+    try:
+        encoder = Encoder(_load_model(model_name, backend, cache_dir), backend, model_name)
+        if bundle is not None and backend != "torch":
+            encoder.parity = check_parity(encoder, *reference_sample(bundle))
+    except Exception as exc:
+        # Missing optimum/onnxruntime, a failed export, or a parity failure
+        if not fallback or backend == "torch":
+            raise
+        print(f"⚠️ {backend} encoder rejected ({exc}); serving with torch")
+        return load_encoder(model_name, "torch", cache_dir=cache_dir)
+    print(f"🧠 Loaded {backend} encoder in {time.perf_counter() - start:.2f}s"
+          + (f", min cosine {encoder.parity['min_cosine']:.4f} vs bundle" if encoder.parity else ""))
+    return encoder
+
+class EncoderLoader:
+    """Loads the query encoder on a background thread so a server can answer before it is ready.
+
+    Until `ready`, callers fall back to lexical search. The thread is started
+    per process, so pre-forked workers each load their own encoder unless the
+    master already called load() before forking. Given a watcher, the
+    encoder's parity is checked against the current bundle.
+    """
+
+    def __init__(self, model_name, backend=ENCODER_BACKEND, watcher=None, on_ready=None, torch_threads=None):
+        self.model_name = model_name
+        self.backend = backend
+        self.watcher = watcher
+        self.on_ready = on_ready
+        self.torch_threads = torch_threads
+        self.encoder = None
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.encoder is not None
+
+    def start(self):
+        if self.ready or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if not self.ready and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="encoder-loader", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as exc:
+            self.error = str(exc)
+            print(f"❌ Encoder failed to load: {exc}")
+
+    def load(self):
+        """Load synchronously (idempotent); returns the encoder"""
+        with self._load_lock:
+            if self.encoder is not None:
+                return self.encoder
+            start = time.perf_counter()
+            if self.torch_threads:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            if self.watcher is None:
+                encoder = load_encoder(self.model_name, self.backend)
+            else:
+                with self.watcher.snapshot() as bundle:
+                    encoder = load_encoder(self.model_name, self.backend, bundle=bundle)
+            if self.on_ready:
+                self.on_ready(encoder)
+            self.load_seconds = time.perf_counter() - start
+            self.encoder = encoder
+            self.error = None
+            return encoder
+
+    def stats(self):
+        stats = self.encoder.stats() if self.ready else {"backend": self.backend, "model_name": self.model_name}
+        loading = self._thread is not None and self._thread.is_alive()
+        return {**stats, "ready": self.ready, "loading": loading, "load_seconds": self.load_seconds, "error": self.error}
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from bundle import load_bundle
+
+    parser = argparse.ArgumentParser(description="Parity and latency of each encoder backend against the bundle embeddings")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--queries", type=int, default=200, help="single-query encodes timed per backend")
+    args = parser.parse_args()
+
+    bundle = load_bundle()
+    texts, reference = reference_sample(bundle)
+    queries = [item["question"] for item in bundle.corpus][:args.queries]
+    report = {}
+    for backend in args.backends.split(","):
+        encoder = load_encoder(bundle.model_name, backend, fallback=False)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query])
+            latencies.append((time.perf_counter() - start) * 1000)
+        try:
+            parity = check_parity(encoder, texts, reference)
+        except EncoderParityError as exc:
+            parity = {"error": str(exc)}
+        report[backend] = {"parity": parity, "p50_ms": float(np.percentile(latencies, 50)),
+                           "p95_ms": float(np.percentile(latencies, 95))}
+    print(json.dumps(report, indent=2))
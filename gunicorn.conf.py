@@ -0,0 +1,38 @@
+# Production serving for the Flask backend:
+#   gunicorn -c gunicorn.conf.py app_backend:app
+#
+# The app is imported once in the master (preload_app) so the mmapped bundle
+# is loaded before forking and shared by the workers. The query encoder is
+# loaded by each worker on a background thread after fork, so workers answer
+# (lexically) right away and the master never imports torch. Set
+# ENCODER_PRELOAD=1 to load it in the master instead: workers then share the
+# weights copy-on-write, but nothing is served until it has loaded. Each worker
+# answers requests on a small thread pool; the QueryBatcher in each worker
+# funnels all model calls through one thread.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+timeout = 60
+encoder_preload = os.environ.get("ENCODER_PRELOAD", "0") == "1"
+
+def when_ready(server):
+    if encoder_preload:
+        import app_backend
+        app_backend.encoder.load()
+    # Move everything loaded so far out of the GC's reach so collections in
+    # the workers don't touch (and un-share) those pages
+    gc.freeze()
+
+def post_fork(server, worker):
+    import app_backend
+    # Split the cores between workers instead of letting each torch grab all of them
+    app_backend.encoder.torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    if app_backend.encoder.ready:
+        import torch
+        torch.set_num_threads(app_backend.encoder.torch_threads)
+    app_backend.encoder.start()
@@ -0,0 +1,142 @@
+import os
+import re
+import numpy as np
+
+TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+STOPWORDS = frozenset("""
+a about an and are as at be by can do does for from how i if in is it me my of on or our should
+that the their there this to was what when where which who why will with you your
+""".split())
+# Question text and tags say more about what a record is about than answer prose
+FIELD_WEIGHTS = {"question": 2.0, "answer": 1.0, "tags": 1.5}
+PHRASE_WEIGHT = 2.0
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def load_keywords(keywords_file="keywords_index.txt"):
+    """Keyword phrases from the handbook keyword index ("- Dean on Call" lines)"""
+    try:
+        with open(keywords_file, 'r', encoding='utf-8') as f:
+            return [line[2:].strip() for line in f if line.startswith("- ") and line[2:].strip()]
+    except FileNotFoundError:
+        return []
+
+def phrase_term(tokens):
+    return "_".join(tokens)
+
+def _phrase_terms(tokens, phrases):
+    """Multi-word keyword phrases occurring contiguously in a token list"""
+    found = []
+    for phrase in phrases:
+        n = len(phrase)
+        if any(tokens[i:i + n] == list(phrase) for i in range(len(tokens) - n + 1)):
+            found.append(phrase_term(phrase))
+    return found
+
+class LexicalIndex:
+    """BM25 inverted index with impact-ordered postings stored as flat arrays.
+
+    Each posting carries its precomputed BM25 weight, so scoring a query is a
+    sum of array slices. Multi-word phrases from keywords_index.txt are indexed
+    as extra terms, and their words make up the vocabulary for which
+    `is_keyword_query` allows a lexical-only answer.
+    """
+
+    def __init__(self, vocab, offsets, docs, weights, keyword_tokens, phrases, doc_count):
+        self.vocab = vocab
+        self.lookup = {term: i for i, term in enumerate(vocab)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.keyword_tokens = frozenset(keyword_tokens)
+        self.phrases = [tuple(phrase.split("_")) for phrase in phrases]
+        self.doc_count = doc_count
+
+    @classmethod
+    def build(cls, corpus, keywords=(), k1=1.2, b=0.75):
+        keyword_tokens = sorted({token for phrase in keywords for token in tokenize(phrase)})
+        phrases = sorted({tuple(tokenize(phrase)) for phrase in keywords if len(tokenize(phrase)) > 1})
+
+        term_freqs = []
+        lengths = np.zeros(len(corpus), dtype=np.float32)
+        for i, item in enumerate(corpus):
+            tf = {}
+            fields = {"question": item["question"], "answer": item["answer"], "tags": " ".join(item.get("tags", []))}
+            for field, text in fields.items():
+                tokens = tokenize(text)
+                for token in tokens:
+                    tf[token] = tf.get(token, 0.0) + FIELD_WEIGHTS[field]
+                for term in _phrase_terms(tokens, phrases):
+                    tf[term] = tf.get(term, 0.0) + PHRASE_WEIGHT * FIELD_WEIGHTS[field]
+                lengths[i] += len(tokens) * FIELD_WEIGHTS[field]
+            term_freqs.append(tf)
+
+        avg_length = float(lengths.mean()) if len(corpus) else 1.0
+        postings = {}
+        for doc, tf in enumerate(term_freqs):
+            for term, freq in tf.items():
+                postings.setdefault(term, []).append((doc, freq))
+
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        docs, weights = [], []
+        for t, term in enumerate(vocab):
+            plist = postings[term]
+            idf = np.log(1.0 + (len(corpus) - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc, freq in plist:
+                norm = k1 * (1.0 - b + b * lengths[doc] / avg_length)
+                docs.append(doc)
+                weights.append(idf * freq * (k1 + 1.0) / (freq + norm))
+            offsets[t + 1] = len(docs)
+        return cls(vocab, offsets, np.array(docs, dtype=np.int32), np.array(weights, dtype=np.float32),
+                   keyword_tokens, [phrase_term(p) for p in phrases], len(corpus))
+
+    def save(self, path):
+        with open(os.path.join(path, "bm25_vocab.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(self.vocab))
+        with open(os.path.join(path, "bm25_keywords.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(sorted(self.keyword_tokens)) + "\n\n" + "\n".join(phrase_term(p) for p in self.phrases))
+        np.save(os.path.join(path, "bm25_postings.idx.npy"), self.offsets)
+        np.save(os.path.join(path, "bm25_docs.npy"), self.docs)
+        np.save(os.path.join(path, "bm25_weights.npy"), self.weights)
+
+    @classmethod
+    def load(cls, path, doc_count):
+        with open(os.path.join(path, "bm25_vocab.txt"), 'r', encoding='utf-8') as f:
+            vocab = f.read().split("\n")
+        with open(os.path.join(path, "bm25_keywords.txt"), 'r', encoding='utf-8') as f:
+            keyword_part, _, phrase_part = f.read().partition("\n\n")
+        return cls(vocab,
+                   np.load(os.path.join(path, "bm25_postings.idx.npy"), mmap_mode='r'),
+                   np.load(os.path.join(path, "bm25_docs.npy"), mmap_mode='r'),
+                   np.load(os.path.join(path, "bm25_weights.npy"), mmap_mode='r'),
+                   keyword_part.split(), phrase_part.split(), doc_count)
+
+    def query_terms(self, query):
+        tokens = tokenize(query)
+        return tokens + _phrase_terms(tokens, self.phrases)
+
+    def is_keyword_query(self, query):
+        """Short queries made only of handbook keywords or acronyms (FERPA, SET, CAPS) the corpus contains"""
+        words = TOKEN_RE.findall(query)
+        tokens = tokenize(query)
+        if not 1 <= len(tokens) <= 3:
+            return False
+        acronyms = {word.lower() for word in words if len(word) >= 2 and word.isupper()}
+        return all(token in self.lookup and (token in self.keyword_tokens or token in acronyms) for token in tokens)
+
+    def search(self, query, k=10):
+        """Top-k (scores, row ids) by BM25, best first; empty arrays when nothing matches"""
+        term_ids = [self.lookup[term] for term in self.query_terms(query) if term in self.lookup]
+        if not term_ids or k <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            scores[self.docs[start:end]] += self.weights[start:end]
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return scores[hits], hits.astype(np.int64)
@@ -0,0 +1,285 @@
+"""Per-stage latency histograms, a Prometheus text exposition and a sampled slow-query log.
+
+Search code reports each stage with `observe(stage, seconds)`; that is a
+bisect and an increment under a lock, so it can stay on the hot path. A
+request wrapped in `trace(name, query)` also collects its own stage breakdown. When
+the whole request takes longer than SLOW_QUERY_MS, a sampled share of them
+(SLOW_QUERY_SAMPLE) is appended as JSON lines to SLOW_QUERY_LOG (unset: off).
+Every traced request with a query is also handed to the query log, which
+precompute.py mines for head queries. It is off unless a server installs one
+(`stage_metrics.query_log = QueryLog()`, writing to QUERY_LOG_DIR), so
+scripts that import the search code never record queries.
+"""
+import os
+import glob
+import json
+import time
+import queue
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Seconds; spans cache hits (sub-ms) to cold model calls
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_SAMPLE = float(os.environ.get("SLOW_QUERY_SAMPLE", "1.0"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG")
+QUERY_LOG_DIR = os.environ.get("QUERY_LOG_DIR", "query_logs")
+QUERY_LOG_MAX_BYTES = int(os.environ.get("QUERY_LOG_MAX_BYTES", str(16 << 20)))
+QUERY_LOG_BACKUPS = int(os.environ.get("QUERY_LOG_BACKUPS", "4"))
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, out = 0, []
+        for count in self.counts:
+            total += count
+            out.append(total)
+        return out
+
+class SlowQueryLog:
+    """Appends a sampled JSON line per slow request: query, total and per-stage milliseconds"""
+
+    def __init__(self, path=SLOW_QUERY_LOG, threshold_ms=SLOW_QUERY_MS, sample_rate=SLOW_QUERY_SAMPLE):
+        self.path = path
+        self.threshold = threshold_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.logged = 0
+        self._lock = threading.Lock()
+
+    def maybe_log(self, name, query, total, stages):
+        if not self.path or total < self.threshold or random.random() >= self.sample_rate:
+            return False
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "pid": os.getpid(),
+            "request": name,
+            "query": query,
+            "total_ms": round(total * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in stages.items()},
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.logged += 1
+        return True
+
+class QueryLog:
+    """Appends a compact JSON line per request from a background thread, rotating files by size.
+
+    `log` only enqueues the entry, so a request never waits on the disk; when
+    the queue is full the entry is dropped and counted instead. Each process
+    writes its own queries-<pid>.jsonl, so workers never rotate each other's
+    file. Past `max_bytes` it becomes .1 (and .1 becomes .2, up to `backups`).
+    """
+
+    def __init__(self, directory=QUERY_LOG_DIR, max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS, queue_size=10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.logged = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_error = None
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"queries-{os.getpid()}.jsonl")
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so each worker has its own writer and file
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    threading.Thread(target=self._run, args=(self._queue, self.path), name="query-log", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def log(self, name, query, total, stages, hit=None, score=None):
+        if not self.directory or not query:
+            return False
+        self._ensure_started()
+        entry = {"ts": round(time.time(), 3), "route": name, "q": query, "ms": round(total * 1000, 2),
+                 "stages": {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()}}
+        if hit is not None:
+            entry["hit"] = hit
+        if score is not None:
+            entry["score"] = round(float(score), 4)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self, entries, path):
+        f = None
+        while True:
+            batch = [entries.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(entries.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if f is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    f = open(path, 'a', encoding='utf-8')
+                f.write("".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in batch))
+                f.flush()
+                self.logged += len(batch)
+                if f.tell() >= self.max_bytes:
+                    f.close()
+                    f = None
+                    self._rotate(path)
+            except OSError as exc:
+                self.failures += 1
+                self.last_error = str(exc)
+                f = None
+
+    def _rotate(self, path):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def stats(self):
+        return {"directory": self.directory or None, "logged": self.logged, "dropped": self.dropped,
+                "pending": self._queue.qsize() if self._queue is not None else 0,
+                "failures": self.failures, "last_error": self.last_error}
+
+def read_query_logs(directory=QUERY_LOG_DIR):
+    """Entries of every query log in `directory`, rotated files included; cut-off lines are skipped"""
+    for path in sorted(glob.glob(os.path.join(directory, "queries-*.jsonl*"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+class RequestTrace:
+    """Stage breakdown of one request; `query` may be filled in once the request is parsed.
+
+    `hit` (the matched corpus question) and `score` describe the top result when known.
+    """
+
+    def __init__(self, name, query=None):
+        self.name = name
+        self.query = query
+        self.stages = {}
+        self.total = None
+        self.hit = None
+        self.score = None
+
+class StageMetrics:
+    """Histograms per (request, stage) plus request counters, shared by all threads of a process"""
+
+    def __init__(self, slow_log=None, query_log=None):
+        self.histograms = {}
+        self.counters = {}
+        self.slow_log = slow_log or SlowQueryLog()
+        # Off by default; app.py and app_backend.py install a QueryLog writing to QUERY_LOG_DIR
+        self.query_log = query_log or QueryLog(directory=None)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        current = getattr(self._local, "trace", None)
+        if current is not None:
+            current.stages[stage] = current.stages.get(stage, 0.0) + seconds
+
+    def add_to_trace(self, stages):
+        """Credit stages that ran on another thread (e.g. a shared batch) to this thread's request"""
+        current = getattr(self._local, "trace", None)
+        if current is not None:
+            for stage, seconds in stages.items():
+                current.stages[stage] = current.stages.get(stage, 0.0) + seconds
+
+    def annotate(self, hit=None, score=None):
+        """Record the top result of this thread's request for the query log"""
+        current = getattr(self._local, "trace", None)
+        if current is not None:
+            current.hit = hit
+            current.score = score
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def trace(self, name, query=None):
+        """Time one request end to end; yields its RequestTrace, filled in as stages run"""
+        current = RequestTrace(name, query)
+        outer = getattr(self._local, "trace", None)
+        self._local.trace = current
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            total = current.total = time.perf_counter() - start
+            self._local.trace = outer
+            self.observe(f"{name}_total", total)
+            self.increment(f"{name}_requests")
+            self.slow_log.maybe_log(name, current.query, total, current.stages)
+            self.query_log.log(name, current.query, total, current.stages, current.hit, current.score)
+
+    def snapshot(self):
+        with self._lock:
+            return ({stage: (h.buckets, h.cumulative(), h.sum, h.count) for stage, h in self.histograms.items()},
+                    dict(self.counters))
+
+    def render_prometheus(self, gauges=None):
+        """Prometheus text exposition (format 0.0.4) of the histograms, counters and extra gauges"""
+        histograms, counters = self.snapshot()
+        lines = ["# HELP search_stage_seconds Time spent per request stage",
+                 "# TYPE search_stage_seconds histogram"]
+        for stage in sorted(histograms):
+            buckets, cumulative, total, count = histograms[stage]
+            for bound, value in zip(buckets, cumulative):
+                lines.append(f'search_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {value}')
+            lines.append(f'search_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative[-1]}')
+            lines.append(f'search_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'search_stage_seconds_count{{stage="{stage}"}} {count}')
+        for name in sorted(counters):
+            lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total {counters[name]}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+stage_metrics = StageMetrics()
+
+def observe(stage, seconds):
+    stage_metrics.observe(stage, seconds)
+
+def trace(name, query=None):
+    return stage_metrics.trace(name, query)
@@ -0,0 +1,185 @@
+"""Precomputed answers for head queries, mined from the query logs.
+
+Both servers log every query (metrics.QueryLog, installed by app.py and
+app_backend.py only). `python precompute.py` reads those logs and counts
+queries by normalized text per kind: "ask" for /ask and /ask/stream,
+"search" for the Streamlit search. It then:
+
+  - recomputes the responses of the head queries (seen at least --min-count
+    times) against the current bundle, through the same batcher and
+    enhanced_search calls the servers use, and
+  - lists frequent misses, i.e. queries whose logged top score stayed below
+    --miss-score, for the corpus authors.
+
+The table is written to PRECOMPUTED_ANSWERS with the bundle version and the
+search parameters it was computed for. Servers load it at startup
+(AnswerTable). While they serve that bundle version with the same
+parameters, a head query is a dictionary lookup instead of an encode and
+search. After a reload to another version the table is ignored until the
+job runs again.
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from query_cache import normalize_query
+from batcher import QueryBatcher
+from retrieve import enhanced_search
+
+PRECOMPUTED_ANSWERS = os.environ.get("PRECOMPUTED_ANSWERS", "precomputed_answers.json")
+# Trace names (metrics.trace) logged by each kind of response
+KIND_ROUTES = {"ask": ("ask", "ask_stream"), "search": ("search",)}
+
+class AnswerTable:
+    """Responses of head queries for one bundle version, looked up by normalized query"""
+
+    def __init__(self, version, sections, created_at=None):
+        self.version = version
+        self.sections = sections
+        self.created_at = created_at
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path=PRECOMPUTED_ANSWERS):
+        """The table at `path`, or None when there is none or it cannot be read"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                table = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            print(f"⚠️ Ignoring precomputed answers in {path}: {exc}")
+            return None
+        print(f"📋 Loaded {sum(len(s['entries']) for s in table['sections'].values())} precomputed answers "
+              f"for bundle {table['version']}")
+        return cls(table["version"], table["sections"], table.get("created_at"))
+
+    def get(self, kind, query, version, params):
+        """The precomputed response, or None unless it was computed for `version` with the same `params`"""
+        section = self.sections.get(kind)
+        if section is None or version != self.version or section["params"] != params:
+            return None
+        value = section["entries"].get(normalize_query(query))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [dict(item) if isinstance(item, dict) else item for item in value]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"version": self.version, "created_at": self.created_at,
+                "entries": {kind: len(section["entries"]) for kind, section in self.sections.items()},
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+def mine_queries(entries, miss_score=0.3):
+    """Per kind, {normalized query: {"query", "count", "misses", "scored", "score_total"}} from log entries.
+
+    A logged request is a miss when its top score is below `miss_score` or it
+    was scored but matched nothing.
+    """
+    kinds = {route: kind for kind, routes in KIND_ROUTES.items() for route in routes}
+    mined = {kind: {} for kind in KIND_ROUTES}
+    for entry in entries:
+        kind = kinds.get(entry.get("route"))
+        key = normalize_query(entry.get("q") or "")
+        if kind is None or not key:
+            continue
+        stats = mined[kind].get(key)
+        if stats is None:
+            stats = mined[kind][key] = {"query": entry["q"], "count": 0, "misses": 0, "scored": 0, "score_total": 0.0}
+        stats["count"] += 1
+        score = entry.get("score")
+        if score is not None:
+            stats["scored"] += 1
+            stats["score_total"] += score
+            if score < miss_score or entry.get("hit") is None:
+                stats["misses"] += 1
+    return mined
+
+def head_queries(mined, min_count=3, max_entries=500):
+    """The most frequent queries seen at least `min_count` times, as their first logged spelling"""
+    ranked = sorted(mined.values(), key=lambda stats: -stats["count"])
+    return [stats["query"] for stats in ranked[:max_entries] if stats["count"] >= min_count]
+
+def frequent_misses(mined, limit=100):
+    misses = [{"kind": kind, "query": stats["query"], "count": stats["count"], "misses": stats["misses"],
+               "mean_score": round(stats["score_total"] / stats["scored"], 4)}
+              for kind, queries in mined.items() for stats in queries.values() if stats["misses"]]
+    return sorted(misses, key=lambda miss: (-miss["misses"], -miss["count"]))[:limit]
+
+def precompute_answers(mined, bundle, model, min_count=3, max_entries=500, diversity=0.3, reranker=None, workers=16):
+    """Sections of the answer table, computed with the servers' own code paths"""
+    batcher = QueryBatcher(model, bundle.corpus, bundle.index, lexical=bundle.lexical, reranker=reranker)
+    heads = head_queries(mined["ask"], min_count, max_entries)
+    # Concurrent questions share batched encodes and searches, as on /ask
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        answers = list(pool.map(batcher.ask, heads))
+    sections = {"ask": {"params": {"k": batcher.k, "threshold": batcher.threshold, "reranked": reranker is not None},
+                        "entries": {normalize_query(query): answer for query, answer in zip(heads, answers)}}}
+
+    heads = head_queries(mined["search"], min_count, max_entries)
+    sections["search"] = {
+        "params": {"k": 5, "threshold": 0.0, "diversity": diversity, "lexical": bundle.lexical is not None,
+                   "reranked": reranker is not None},
+        "entries": {normalize_query(query): enhanced_search(query, model, bundle.corpus, bundle.index, k=5, threshold=0.0,
+                                                            lexical=bundle.lexical, reranker=reranker, diversity=diversity)
+                    for query in heads},
+    }
+    return sections
+
+def write_table(path, version, sections, misses):
+    table = {"version": version, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+             "sections": sections, "misses": misses}
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False)
+    # Servers starting meanwhile read the old table or the new one, never half of one
+    os.replace(tmp_path, path)
+    return table
+
+if __name__ == "__main__":
+    from metrics import read_query_logs, QUERY_LOG_DIR
+
+    parser = argparse.ArgumentParser(description="Mine the query logs and precompute answers for head queries")
+    parser.add_argument("--log-dir", default=QUERY_LOG_DIR, help="directory of queries-*.jsonl logs")
+    parser.add_argument("--min-count", type=int, default=3, help="times a query must be logged to be precomputed")
+    parser.add_argument("--max-entries", type=int, default=500, help="precomputed queries per kind")
+    parser.add_argument("--miss-score", type=float, default=0.3, help="top scores below this count as misses")
+    parser.add_argument("--diversity", type=float, default=0.3, help="MMR weight of the Streamlit search (app.RESULT_DIVERSITY)")
+    parser.add_argument("--rerank", action="store_true", help="precompute for servers running with RERANK=1")
+    parser.add_argument("--output", default=PRECOMPUTED_ANSWERS, help="answer table to write")
+    args = parser.parse_args()
+
+    from bundle import load_bundle
+    from encoders import load_encoder
+    from retrieve import semantic_cache
+
+    start = time.perf_counter()
+    mined = mine_queries(read_query_logs(args.log_dir), args.miss_score)
+    logged = {kind: sum(stats["count"] for stats in queries.values()) for kind, queries in mined.items()}
+    print(f"📜 Read {sum(logged.values())} logged queries in {time.perf_counter() - start:.2f}s")
+
+    bundle = load_bundle()
+    model = load_encoder(bundle.model_name, bundle=bundle)
+    reranker = None
+    if args.rerank:
+        from rerank import Reranker
+
+        reranker = Reranker()
+        reranker.load()
+    # Each head query gets its own answer, not a cached paraphrase's
+    semantic_cache.enabled = False
+    sections = precompute_answers(mined, bundle, model, args.min_count, args.max_entries, args.diversity, reranker)
+    misses = frequent_misses(mined)
+    table = write_table(args.output, bundle.version, sections, misses)
+
+    for kind, section in sections.items():
+        covered = sum(mined[kind][key]["count"] for key in section["entries"])
+        share = covered / logged[kind] if logged[kind] else 0.0
+        print(f"✅ {kind}: {len(section['entries'])} head queries, {share:.0%} of {logged[kind]} logged requests")
+    for miss in misses[:10]:
+        print(f"❓ {miss['kind']}: {miss['query']!r} missed {miss['misses']}/{miss['count']} (mean score {miss['mean_score']})")
+    print(f"📋 Wrote {args.output} for bundle {bundle.version}")
@@ -0,0 +1,126 @@
+"""Import-time and startup profile of each entry point, for tracking across releases.
+
+    python profile_startup.py --output startup_profile.json
+    python profile_startup.py --baseline startup_profile.json
+
+Every measurement runs in a fresh interpreter so nothing is already imported.
+Import costs come from `python -X importtime`. The backend profile times how
+long app_backend takes to import (when a server can bind its port), its first
+lexical answer, and how long until the encoder is ready.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+ENTRY_MODULES = ["query_cache", "lexical", "retrieve", "bundle", "reloader", "batcher", "encoders", "embed_index"]
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+BACKEND_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import app_backend
+imported = time.perf_counter()
+torch_at_bind = "torch" in sys.modules
+client = app_backend.app.test_client()
+client.post("/ask", json={"question": "office hours"})
+first_answer = time.perf_counter()
+deadline = first_answer + float(sys.argv[1])
+while not app_backend.encoder.ready and app_backend.encoder.error is None and time.perf_counter() < deadline:
+    time.sleep(0.05)
+ready = time.perf_counter()
+report = {"import_s": imported - start, "first_lexical_answer_s": first_answer - start,
+          "encoder_ready_s": ready - start if app_backend.encoder.ready else None,
+          "encoder_error": app_backend.encoder.error, "torch_imported_at_bind": torch_at_bind}
+if app_backend.encoder.ready:
+    step = time.perf_counter()
+    client.post("/ask", json={"question": "How do I interpret SET survey results?"})
+    report["first_dense_answer_s"] = time.perf_counter() - step
+print("PROFILE " + json.dumps(report))
+"""
+
+def profile_import(module, repeat=3):
+    """Cumulative import seconds of `module` and its heaviest direct dependencies; the fastest of `repeat` runs"""
+    runs = [_import_run(module) for _ in range(repeat)]
+    return min(runs, key=lambda run: run.get("import_s", float("inf")))
+
+def _import_run(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    total, deps, pending, torch = None, [], [], False
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)), match.group(4)
+        depth = (len(match.group(3)) - 1) // 2
+        torch = torch or name == "torch"
+        # Children are printed before their parent, so collect them until the top-level line
+        if depth == 1:
+            pending.append((cumulative, name))
+        elif depth == 0:
+            if name == module:
+                total, deps = cumulative, pending
+            pending = []
+    heaviest = sorted(deps, reverse=True)[:5]
+    return {"import_s": (total or 0) / 1e6, "heaviest": {name: us / 1e6 for us, name in heaviest}, "torch": torch}
+
+def profile_backend(timeout=120):
+    result = subprocess.run([sys.executable, "-c", BACKEND_PROBE, str(timeout)], capture_output=True, text=True,
+                            timeout=timeout + 60)
+    for line in result.stdout.splitlines():
+        if line.startswith("PROFILE "):
+            return json.loads(line[len("PROFILE "):])
+    return {"error": (result.stderr.strip().splitlines() or ["failed"])[-1]}
+
+def compare(report, baseline):
+    """Print seconds that changed by more than 10% against a previous report"""
+    rows = []
+    for module, stats in report["imports"].items():
+        before = baseline.get("imports", {}).get(module, {}).get("import_s")
+        if before is not None and "import_s" in stats:
+            rows.append((f"import {module}", before, stats["import_s"]))
+    for key, value in report["backend"].items():
+        before = baseline.get("backend", {}).get(key)
+        if key.endswith("_s") and isinstance(value, float) and isinstance(before, float):
+            rows.append((f"app_backend {key}", before, value))
+    print(f"\n{'metric':<40}{'baseline':>10}{'now':>10}{'change':>9}")
+    for name, before, now in rows:
+        change = (now - before) / before if before else 0.0
+        flag = "  ⚠️" if change > 0.10 and now - before > 0.05 else ""
+        print(f"{name:<40}{before:>10.3f}{now:>10.3f}{change:>+9.0%}{flag}")
+
+def print_report(report):
+    print(f"{'module':<16}{'import s':>10}  torch  heaviest dependencies")
+    for module, stats in report["imports"].items():
+        if "error" in stats:
+            print(f"{module:<16}{'error':>10}  {stats['error']}")
+            continue
+        heaviest = ", ".join(f"{name} {secs:.2f}" for name, secs in list(stats["heaviest"].items())[:3])
+        print(f"{module:<16}{stats['import_s']:>10.3f}  {'yes' if stats['torch'] else 'no':<5}  {heaviest}")
+    print("\napp_backend: " + json.dumps(report["backend"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile import time and startup of the entry points")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="compare against a report written by --output")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the encoder")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per module import (fastest kept)")
+    parser.add_argument("--skip-backend", action="store_true", help="only profile imports")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    report = {"python": sys.version.split()[0],
+              "imports": {module: profile_import(module, args.repeat) for module in ENTRY_MODULES},
+              "backend": {} if args.skip_backend else profile_backend(args.timeout)}
+    print_report(report)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
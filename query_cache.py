@@ -0,0 +1,211 @@
+import time
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def normalize_query(query):
+    """Canonical cache key for a query: lowercased with collapsed whitespace"""
+    return " ".join(query.lower().split())
+
+class QueryCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class SemanticCache:
+    """Results of recent queries, found again by embedding similarity.
+
+    Each scope (a search kind and its parameters) has a small exact
+    inner-product index of cached query embeddings. A lookup returns the
+    value of the nearest cached query when its cosine is at least
+    `min_cosine`, so a paraphrase is answered without searching the corpus.
+    Entries expire after `ttl` and the least recently used are evicted beyond
+    `maxsize`. Versions are the index tokens of retrieve.index_token, and each
+    (scope, version) pair has its own space, so indexes served side by side
+    (two bundles, or a benchmark's several indexes) never see each other's
+    results. `retire(version)` drops everything cached for an index once it
+    is gone.
+    """
+    # Nearest cached queries checked per lookup, so an expired nearest one falls through to the next
+    NEIGHBORS = 4
+
+    def __init__(self, maxsize=4096, ttl=600, min_cosine=0.92, enabled=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.min_cosine = min_cosine
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.hit_cosine_total = 0.0
+        self._spaces = {}
+        self._entries = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._retired = []
+
+    def retire(self, version):
+        """Drop the entries of an index version at the next lookup.
+
+        Safe to call from a weakref finalizer: it only queues the version, so it
+        never waits for the lock a collecting thread may already hold.
+        """
+        self._retired.append(version)
+
+    def _drop_retired(self):
+        while self._retired:
+            version = self._retired.pop()
+            keys = [key for key in self._spaces if key[1] == version]
+            for key in keys:
+                del self._spaces[key]
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry[0][1] == version]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            if stale:
+                self.invalidations += 1
+
+    def get(self, scope, embedding, version):
+        return self.get_many(scope, embedding, version)[0]
+
+    def get_many(self, scope, embeddings, version):
+        """Cached value (or None) per row of `embeddings`, with one similarity search for all rows"""
+        embeddings = np.ascontiguousarray(np.atleast_2d(embeddings), dtype=np.float32)
+        found = [None] * len(embeddings)
+        if not self.enabled:
+            return found
+        with self._lock:
+            self._drop_retired()
+            space = self._spaces.get((scope, version))
+            if space is not None and space.ntotal:
+                scores, ids = space.search(embeddings, min(self.NEIGHBORS, space.ntotal))
+                now = time.monotonic()
+                for row, (row_scores, row_ids) in enumerate(zip(scores.tolist(), ids.tolist())):
+                    for score, entry_id in zip(row_scores, row_ids):
+                        if score < self.min_cosine:
+                            break
+                        # Already removed when it expired for an earlier row
+                        entry = self._entries.get(entry_id)
+                        if entry is None:
+                            continue
+                        if entry[2] <= now:
+                            self._remove(entry_id)
+                            continue
+                        self._entries.move_to_end(entry_id)
+                        self.hit_cosine_total += score
+                        found[row] = entry[1]
+                        break
+            hits = sum(1 for value in found if value is not None)
+            self.hits += hits
+            self.misses += len(found) - hits
+        return found
+
+    def set(self, scope, embedding, value, version):
+        self.set_many(scope, embedding, [value], version)
+
+    def set_many(self, scope, embeddings, values, version):
+        if not self.enabled:
+            return
+        import faiss
+
+        embeddings = np.ascontiguousarray(np.atleast_2d(embeddings), dtype=np.float32)
+        with self._lock:
+            self._drop_retired()
+            key = (scope, version)
+            space = self._spaces.get(key)
+            if space is None:
+                space = self._spaces[key] = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+            ids = np.array([next(self._ids) for _ in values], dtype=np.int64)
+            space.add_with_ids(embeddings, ids)
+            expires = time.monotonic() + self.ttl
+            for entry_id, value in zip(ids.tolist(), values):
+                self._entries[entry_id] = (key, value, expires)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id):
+        key, _, _ = self._entries.pop(entry_id)
+        space = self._spaces[key]
+        space.remove_ids(np.array([entry_id], dtype=np.int64))
+        if not space.ntotal:
+            del self._spaces[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._spaces.clear()
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "min_cosine": self.min_cosine,
+            "scopes": len({scope for scope, _ in self._spaces}),
+            "versions": len({version for _, version in self._spaces}),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "mean_hit_cosine": self.hit_cosine_total / self.hits if self.hits else None,
+        }
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from bundle import load_bundle, read_manifest, BUNDLE_DIR
+
+RELOAD_INTERVAL = float(os.environ.get("BUNDLE_RELOAD_INTERVAL", "5"))
+
+class Snapshot:
+    """Reference-counted handle on one loaded bundle"""
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.refs = 0
+        self.retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.refs += 1
+            return self.bundle
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            close = self.retired and self.refs == 0
+        if close:
+            self.bundle.close()
+
+    def retire(self):
+        with self._lock:
+            self.retired = True
+            close = self.refs == 0
+        if close:
+            self.bundle.close()
+
+class BundleWatcher:
+    """Serves the current index bundle and hot-swaps in new versions as they are written.
+
+    A background thread polls manifest.json. When the bundle version changes it
+    loads the new bundle (and runs `on_load`, e.g. cache warm-up) off the
+    request path, then swaps it in. Queries hold a snapshot for their whole
+    duration, so in-flight work finishes on the old bundle, which is closed
+    once its last user releases it.
+    """
+
+    def __init__(self, path=BUNDLE_DIR, interval=RELOAD_INTERVAL, on_load=None):
+        self.path = path
+        self.interval = interval
+        self.on_load = on_load
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._signature = self._manifest_signature()
+        bundle = load_bundle(path)
+        if on_load:
+            on_load(bundle)
+        self._current = Snapshot(bundle)
+
+    @property
+    def current(self):
+        return self._current.bundle
+
+    @property
+    def version(self):
+        return self._current.bundle.version
+
+    def _manifest_signature(self):
+        try:
+            st = os.stat(os.path.join(self.path, "manifest.json"))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    @contextmanager
+    def snapshot(self):
+        """Borrow the current bundle for the duration of one query"""
+        self._ensure_started()
+        with self._lock:
+            snap = self._current
+            bundle = snap.acquire()
+        try:
+            yield bundle
+        finally:
+            snap.release()
+
+    def check(self):
+        """Load and swap in the bundle on disk if its version changed; returns True on a swap"""
+        signature = self._manifest_signature()
+        if signature is None or signature == self._signature:
+            return False
+        manifest = read_manifest(self.path)
+        if manifest["version"] == self.version:
+            self._signature = signature
+            return False
+        if manifest["model_name"] != self.current.model_name:
+            raise ValueError(f"Bundle {manifest['version']} needs model {manifest['model_name']}; restart to switch models")
+
+        bundle = load_bundle(self.path)
+        # A rebuild landing mid-load could mix files from two versions; retry on the next poll
+        if read_manifest(self.path)["version"] != bundle.version:
+            bundle.close()
+            return False
+        if self.on_load:
+            self.on_load(bundle)
+
+        with self._lock:
+            old = self._current
+            self._current = Snapshot(bundle)
+            self._signature = signature
+        old.retire()
+        self.reloads += 1
+        print(f"🔄 Swapped index bundle {old.bundle.version} -> {bundle.version}")
+        return True
+
+    def _ensure_started(self):
+        # Started lazily so each pre-forked worker runs its own watcher thread
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="bundle-watcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as exc:
+                self.failures += 1
+                self.last_error = str(exc)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "in_use": self._current.refs,
+            "corpus_bytes": self._current.bundle.corpus.memory_usage(),
+        }
@@ -0,0 +1,159 @@
+"""Cross-encoder reranking of dense/hybrid candidates within a latency budget.
+
+A cross-encoder reads the query and a candidate together, so it orders the top
+candidates better than the bi-encoder cosine, but every (query, candidate)
+pair costs a transformer forward pass. It is therefore off by default
+(RERANK=1 enables it) and bounded per request:
+
+    RERANK_MODEL        cross-encoder checkpoint (default cross-encoder/ms-marco-MiniLM-L-6-v2)
+    RERANK_CANDIDATES   dense candidates rescored per query (default 20)
+    RERANK_BATCH        pairs per forward pass (default 16)
+    RERANK_BUDGET_MS    per-request budget (default 60)
+
+Pairs are scored batch by batch. Before each batch the reranker estimates,
+from the per-pair time seen so far, whether the batch would end past the
+budget. If it would, the request keeps the dense order. Scores are cached by
+(query, candidate set), so a repeated query is reordered without any model call.
+"""
+import os
+import time
+import threading
+import numpy as np
+
+from query_cache import QueryCache, normalize_query
+from metrics import observe
+
+RERANK_ENABLED = os.environ.get("RERANK", "0") == "1"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+RERANK_BATCH = int(os.environ.get("RERANK_BATCH", "16"))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "60"))
+
+def candidate_text(result):
+    return result["question"] + " " + result["answer"]
+
+class Reranker:
+    """Reorders search results by cross-encoder score; keeps the dense order when over budget or not loaded"""
+
+    def __init__(self, model_name=RERANK_MODEL, candidates=RERANK_CANDIDATES, batch_size=RERANK_BATCH,
+                 budget_ms=RERANK_BUDGET_MS, cache_size=2048, ttl=600):
+        self.model_name = model_name
+        self.candidates = candidates
+        self.batch_size = max(1, batch_size)
+        self.budget = budget_ms / 1000.0
+        self.model = None
+        self.cache = QueryCache(maxsize=cache_size, ttl=ttl)
+        # Exponentially weighted seconds per pair, used to predict the next batch
+        self.pair_seconds = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.reranked = 0
+        self.cache_hits = 0
+        self.budget_fallbacks = 0
+        self.not_loaded = 0
+        self.pairs_scored = 0
+        self.rerank_seconds = 0.0
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    def load(self):
+        """Load the cross-encoder synchronously (idempotent)"""
+        with self._load_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+
+                start = time.perf_counter()
+                model = CrossEncoder(self.model_name, device="cpu")
+                # The first forward pass is slow; keep it out of the per-pair estimate
+                model.predict([("warm up", "warm up")], show_progress_bar=False)
+                self.model = model
+                print(f"🔀 Loaded reranker {self.model_name} in {time.perf_counter() - start:.2f}s")
+        return self.model
+
+    def _key(self, query, results):
+        return (normalize_query(query), tuple(hash(candidate_text(result)) for result in results))
+
+    def rerank(self, query, results, budget_ms=None):
+        return self.rerank_many([query], [results], budget_ms)[0]
+
+    def rerank_many(self, queries, result_lists, budget_ms=None):
+        """Reorder each result list by cross-encoder score, sharing batches across queries.
+
+        The budget covers the whole call. If it would be exceeded, every list
+        not served from the cache keeps its dense order.
+        """
+        start = time.perf_counter()
+        budget = self.budget if budget_ms is None else budget_ms / 1000.0
+        keys = [self._key(query, results) for query, results in zip(queries, result_lists)]
+        scores = [self.cache.get(key) if results else None for key, results in zip(keys, result_lists)]
+        pending = [i for i, (found, results) in enumerate(zip(scores, result_lists)) if found is None and results]
+        with self._stats_lock:
+            self.requests += len(queries)
+            self.cache_hits += sum(1 for found in scores if found is not None)
+
+        if pending and self.model is None:
+            with self._stats_lock:
+                self.not_loaded += len(pending)
+        elif pending:
+            pairs = [(queries[i], candidate_text(result)) for i in pending for result in result_lists[i]]
+            flat = self._score(pairs, start + budget)
+            if flat is None:
+                with self._stats_lock:
+                    self.budget_fallbacks += len(pending)
+            else:
+                offset = 0
+                for i in pending:
+                    scores[i] = flat[offset:offset + len(result_lists[i])]
+                    offset += len(result_lists[i])
+                    self.cache.set(keys[i], scores[i])
+                with self._stats_lock:
+                    self.reranked += len(pending)
+                    self.pairs_scored += len(pairs)
+
+        reordered = [self._reorder(results, found) for results, found in zip(result_lists, scores)]
+        elapsed = time.perf_counter() - start
+        observe("rerank", elapsed)
+        with self._stats_lock:
+            self.rerank_seconds += elapsed
+        return reordered
+
+    def _score(self, pairs, deadline):
+        """Cross-encoder scores of `pairs`, or None if the next batch would end past `deadline`"""
+        out = []
+        for begin in range(0, len(pairs), self.batch_size):
+            batch = pairs[begin:begin + self.batch_size]
+            if self.pair_seconds is not None and time.perf_counter() + self.pair_seconds * len(batch) > deadline:
+                return None
+            batch_start = time.perf_counter()
+            out.append(np.asarray(self.model.predict(batch, batch_size=len(batch), show_progress_bar=False), dtype=np.float32))
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            self.pair_seconds = per_pair if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * per_pair
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+    @staticmethod
+    def _reorder(results, scores):
+        if scores is None:
+            return results
+        order = np.argsort(-np.asarray(scores), kind="stable")
+        return [{**results[i], "rerank_score": float(scores[i]), "rank": rank}
+                for rank, i in enumerate(order.tolist(), 1)]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model_name": self.model_name,
+                "ready": self.ready,
+                "candidates": self.candidates,
+                "budget_ms": self.budget * 1000.0,
+                "requests": self.requests,
+                "reranked": self.reranked,
+                "cache_hits": self.cache_hits,
+                "budget_fallbacks": self.budget_fallbacks,
+                "not_loaded": self.not_loaded,
+                "pairs_scored": self.pairs_scored,
+                "ms_per_pair": self.pair_seconds * 1000.0 if self.pair_seconds is not None else None,
+                "avg_ms": self.rerank_seconds * 1000.0 / self.requests if self.requests else 0.0,
+            }
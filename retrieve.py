@@ -1,78 +1,630 @@
+import os
+import json
+import time
 import numpy as np
 import faiss
 import pickle
-from sentence_transformers import SentenceTransformer
+import weakref
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from query_cache import QueryCache, SemanticCache, normalize_query
+from metrics import observe
 
 MODEL_NAME = "all-MiniLM-L6-v2"
 
-def load_index(index_file="faiss_index.bin"):
-    return faiss.read_index(index_file)
+FALLBACK_ANSWER = "Not enough information available. Please contact [TLC Consultations](https://teaching.ucla.edu/services/consultations/) for further support."
+
+# Shared by every search path in the process (Streamlit app and Flask backend)
+embedding_cache = QueryCache(maxsize=2048, ttl=3600)
+result_cache = QueryCache(maxsize=1024, ttl=600)
+# Paraphrases of a recent query reuse its results (see query_cache.SemanticCache)
+semantic_cache = SemanticCache(maxsize=int(os.environ.get("SEMANTIC_CACHE_SIZE", "2048")), ttl=600,
+                               min_cosine=float(os.environ.get("SEMANTIC_CACHE_MIN_COSINE", "0.92")),
+                               enabled=os.environ.get("SEMANTIC_CACHE", "1") == "1")
+
+# Reciprocal-rank fusion constant for hybrid search
+RRF_K = 60
+_lexical_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lexical")
+
+# Cached results are keyed by a token per index object rather than id(), which
+# can be reused once a hot-reloaded index is freed
+_index_tokens = weakref.WeakKeyDictionary()
+_token_counter = itertools.count(1)
+
+def index_token(index):
+    token = _index_tokens.get(index)
+    if token is None:
+        fresh = next(_token_counter)
+        token = _index_tokens.setdefault(index, fresh)
+        if token == fresh:
+            # Paraphrase results of a freed (e.g. hot-reloaded) index can never be looked up again
+            weakref.finalize(index, semantic_cache.retire, token)
+    return token
+
+def set_search_params(index, search_params):
+    """Apply runtime knobs such as nprobe (IVF) or efSearch (HNSW) to a loaded index"""
+    space = faiss.ParameterSpace()
+    for name, value in (search_params or {}).items():
+        space.set_index_parameter(index, name, value)
+    return index
+
+def filtered_search_params(index, ids=None, selector=None):
+    """SearchParameters restricting a search to `ids` (or a prebuilt FAISS `selector`), keeping the index's own nprobe/efSearch"""
+    if isinstance(index, PassageIndex):
+        index = index.base
+    if selector is None:
+        selector = faiss.IDSelectorBatch(ids)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    except RuntimeError:
+        pass
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+class PassageIndex:
+    """Wraps a FAISS index over passages so searches return parent (corpus row) ids.
+
+    Long records are embedded as several passages (see chunking.py). Each
+    parent is scored by its best passage, and searches over-fetch passages so
+    k distinct parents usually come back. Results have the same shape and
+    padding as a plain FAISS search, so every search path can use either.
+    """
+    OVERFETCH = 4
+
+    def __init__(self, base, parents):
+        self.base = base
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.ntotal = int(self.parents.max()) + 1 if len(self.parents) else 0
+        # A parent's first passage stands in for it where one vector per record is needed (MMR)
+        self.first_passage = np.unique(self.parents, return_index=True)[1]
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def search(self, queries, k, params=None):
+        n_fetch = min(self.base.ntotal, k * self.OVERFETCH)
+        passage_scores, passage_ids = self.base.search(queries, n_fetch, params=params)
+        scores = np.full((len(queries), k), -np.finfo(np.float32).max, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        valid = passage_ids >= 0
+        parent_ids = self.parents[np.where(valid, passage_ids, 0)]
+        # Hits are sorted, so a parent's first occurrence is its best passage
+        keep = first_occurrences(parent_ids, valid)
+        ranks = np.cumsum(keep, axis=1)
+        rows, cols = np.nonzero(keep & (ranks <= k))
+        indices[rows, ranks[rows, cols] - 1] = parent_ids[rows, cols]
+        scores[rows, ranks[rows, cols] - 1] = passage_scores[rows, cols]
+        return scores, indices
+
+def first_occurrences(groups, valid):
+    """Mask of the valid entries of each row whose group id does not occur earlier in that row"""
+    keyed = np.where(valid, groups, -1)
+    # A stable sort keeps equal ids in rank order, so the first of each run is the best one
+    order = np.argsort(keyed, axis=1, kind="stable")
+    ordered = np.take_along_axis(keyed, order, axis=1)
+    first = np.ones(ordered.shape, dtype=bool)
+    first[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    mask = np.empty_like(first)
+    np.put_along_axis(mask, order, first, axis=1)
+    return mask & valid
+
+class CorpusColumns:
+    """Column view of a corpus for vectorized result assembly.
+
+    Categories and priorities are int codes in NumPy arrays, so threshold,
+    category and dedup masks run over whole result matrices. Question and
+    answer text is only read for the hits that are returned.
+    """
+
+    def __init__(self, questions, answers, category_codes, categories, priority_codes=None, priorities=()):
+        self.questions = questions
+        self.answers = answers
+        self.category_codes = category_codes
+        self.categories = list(categories)
+        self.priority_codes = priority_codes if priority_codes is not None else np.full(len(category_codes), -1, dtype=np.int8)
+        self.priorities = list(priorities)
+        self._answer_groups = None
+
+    @classmethod
+    def from_records(cls, corpus):
+        categories = sorted({item.get("category") or "General" for item in corpus})
+        priorities = sorted({item["priority"] for item in corpus if item.get("priority")})
+        category_lookup = {category: code for code, category in enumerate(categories)}
+        priority_lookup = {priority: code for code, priority in enumerate(priorities)}
+        questions = np.empty(len(corpus), dtype=object)
+        answers = np.empty(len(corpus), dtype=object)
+        category_codes = np.empty(len(corpus), dtype=np.int16)
+        priority_codes = np.empty(len(corpus), dtype=np.int8)
+        for i, item in enumerate(corpus):
+            questions[i] = item["question"]
+            answers[i] = item["answer"]
+            category_codes[i] = category_lookup[item.get("category") or "General"]
+            priority_codes[i] = priority_lookup.get(item.get("priority"), -1)
+        return cls(questions, answers, category_codes, categories, priority_codes, priorities)
+
+    def __len__(self):
+        return len(self.category_codes)
+
+    @property
+    def answer_groups(self):
+        """Code per row shared by all rows with the same answer text (used for dedup)"""
+        if self._answer_groups is None:
+            answers = np.array([self.answers[i] for i in range(len(self))], dtype=object)
+            self._answer_groups = np.unique(answers, return_inverse=True)[1].astype(np.int64) if len(answers) else answers
+        return self._answer_groups
+
+    def category_codes_for(self, categories):
+        lookup = {category: code for code, category in enumerate(self.categories)}
+        return np.array([lookup[category] for category in categories if category in lookup], dtype=np.int16)
+
+# Record lists (legacy corpus.pkl, ad-hoc corpora) are converted once; bundle corpora carry their own view
+_record_columns = None
+
+def corpus_columns(corpus):
+    global _record_columns
+    columns = getattr(corpus, "column_view", None)
+    if columns is not None:
+        return columns
+    cached = _record_columns
+    if cached is not None and cached[0] is corpus and len(cached[1]) == len(corpus):
+        return cached[1]
+    columns = CorpusColumns.from_records(corpus)
+    _record_columns = (corpus, columns)
+    return columns
+
+def select_hits(indices, columns, k, keep=None, categories=None, dedup=False):
+    """Vectorized filtering of (queries, candidates) result matrices; returns (keep mask, 1-based ranks).
+
+    Starting from `keep` (e.g. a score threshold), padding and out-of-range
+    ids, rows outside `categories` and, with `dedup`, repeats of an answer
+    ranked higher are dropped; then the first k survivors of each query are kept.
+    """
+    valid = (indices >= 0) & (indices < len(columns))
+    if keep is not None:
+        valid &= keep
+    ids = np.where(valid, indices, 0)
+    if categories is not None:
+        valid &= np.isin(columns.category_codes[ids], columns.category_codes_for(categories))
+    if dedup:
+        valid = first_occurrences(columns.answer_groups[ids], valid)
+    ranks = np.cumsum(valid, axis=1)
+    return valid & (ranks <= k), ranks
+
+def assemble_results(scores, indices, keep, ranks, columns):
+    """Result dicts of the kept hits, one list per query"""
+    results = [[] for _ in range(len(indices))]
+    rows, cols = np.nonzero(keep)
+    ids = indices[rows, cols]
+    category_names = columns.categories
+    for row, idx, code, score, rank in zip(rows.tolist(), ids.tolist(), columns.category_codes[ids].tolist(),
+                                           scores[rows, cols].tolist(), ranks[rows, cols].tolist()):
+        results[row].append({
+            "question": columns.questions[idx],
+            "answer": columns.answers[idx],
+            "category": category_names[code],
+            "relevance_score": score,
+            "rank": rank
+        })
+    return results
+
+def candidate_vectors(index, ids):
+    """Stored vectors of result rows, or None when the index cannot reconstruct them (IVF without a direct map)"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if isinstance(index, PassageIndex):
+        ids = index.first_passage[ids]
+        index = index.base
+    try:
+        return index.reconstruct_batch(ids)
+    except RuntimeError:
+        return None
+
+def mmr_order(scores, vectors, k, diversity):
+    """Positions of up to k candidates in maximal-marginal-relevance order.
+
+    Each pick maximizes (1 - diversity) * score - diversity * (highest cosine
+    to an earlier pick), so near-identical answers don't fill every slot.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    relevance = (1.0 - diversity) * np.asarray(scores, dtype=np.float32)
+    closest = np.zeros(len(scores), dtype=np.float32)
+    available = np.ones(len(scores), dtype=bool)
+    picked = []
+    for _ in range(min(k, len(scores))):
+        pick = int(np.argmax(np.where(available, relevance - diversity * closest, -np.inf)))
+        picked.append(pick)
+        available[pick] = False
+        closest = np.maximum(closest, similarity[pick])
+    return np.array(picked, dtype=np.int64)
+
+def diversify_hits(index, scores, indices, keep, k, diversity):
+    """Narrow each row's kept hits to k picked by MMR; returns (scores, indices, keep, ranks) of width k"""
+    out_scores = np.zeros((len(indices), k), dtype=scores.dtype)
+    out_indices = np.full((len(indices), k), -1, dtype=np.int64)
+    for row in range(len(indices)):
+        positions = np.flatnonzero(keep[row])
+        vectors = candidate_vectors(index, indices[row, positions]) if len(positions) > 1 else None
+        if vectors is not None:
+            positions = positions[mmr_order(scores[row, positions], vectors, k, diversity)]
+        positions = positions[:k]
+        out_scores[row, :len(positions)] = scores[row, positions]
+        out_indices[row, :len(positions)] = indices[row, positions]
+    out_keep = out_indices >= 0
+    return out_scores, out_indices, out_keep, np.cumsum(out_keep, axis=1)
+
+def search_embeddings(embeddings, corpus, index, k=5, threshold=None, categories=None, dedup=False, params=None, fetch=None,
+                      boost=None, diversity=0.0):
+    """Batched dense search: one index.search for every query row, vectorized filtering, result dicts per query.
+
+    `fetch` candidates are searched per query (default k) so filters and
+    dedup can still leave k results. `boost(scores, indices)` returns
+    adjusted scores that the candidates are re-ranked and reported by; the
+    threshold still applies to the cosine. With `diversity` > 0 the k results
+    are picked from the surviving candidates by MMR.
+    """
+    columns = corpus_columns(corpus)
+    start = time.perf_counter()
+    if params is None:
+        scores, indices = index.search(embeddings, fetch or k)
+    else:
+        scores, indices = index.search(embeddings, fetch or k, params=params)
+    searched = time.perf_counter()
+    keep = None if threshold is None else scores >= threshold
+    if boost is not None:
+        boosted = boost(scores, indices)
+        # Padding (-1) sorts last whatever its boost
+        order = np.argsort(np.where(indices >= 0, -boosted, np.inf), axis=1, kind="stable")
+        scores, indices = np.take_along_axis(boosted, order, axis=1), np.take_along_axis(indices, order, axis=1)
+        keep = None if keep is None else np.take_along_axis(keep, order, axis=1)
+    if diversity:
+        keep, _ = select_hits(indices, columns, indices.shape[1], keep, categories, dedup)
+        scores, indices, keep, ranks = diversify_hits(index, scores, indices, keep, k, diversity)
+    else:
+        keep, ranks = select_hits(indices, columns, k, keep, categories, dedup)
+    results = assemble_results(scores, indices, keep, ranks, columns)
+    observe("search", searched - start)
+    observe("lookup", time.perf_counter() - searched)
+    return results
+
+# Index loading is shared with bundle.py; load_corpus reads the legacy corpus.pkl
+def load_index(index_file="faiss_index.bin", mmap=False, search_params=None):
+    """Read the FAISS index; with mmap=True flat vector storage stays in the page cache shared by all processes"""
+    if mmap:
+        index = faiss.read_index(index_file, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))
+    else:
+        index = faiss.read_index(index_file)
+    return set_search_params(index, search_params)
 
 def load_corpus(corpus_file="corpus.pkl"):
     with open(corpus_file, 'rb') as f:
         return pickle.load(f)
 
+def encode_query(query, model):
+    """Embed a single query, reusing the cached embedding for repeated queries"""
+    key = normalize_query(query)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        start = time.perf_counter()
+        embedding = model.encode([key])
+        observe("encode", time.perf_counter() - start)
+        embedding_cache.set(key, embedding)
+    return embedding
+
+def encode_queries(queries, model):
+    """Embed a batch of queries with a single model call for the ones not already cached"""
+    keys = [normalize_query(q) for q in queries]
+    embeddings = [embedding_cache.get(key) for key in keys]
+    missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+    if missing:
+        start = time.perf_counter()
+        encoded = model.encode(missing)
+        observe("encode", time.perf_counter() - start)
+        fresh = {}
+        for key, embedding in zip(missing, encoded):
+            fresh[key] = embedding.reshape(1, -1)
+            embedding_cache.set(key, fresh[key])
+        embeddings = [embedding if embedding is not None else fresh[key] for key, embedding in zip(keys, embeddings)]
+    return np.vstack(embeddings)
+
+def warm_query_cache(queries, model):
+    """Pre-encode known queries (e.g. UI buttons) in one batch so they skip the transformer later"""
+    keys = [key for key in dict.fromkeys(normalize_query(q) for q in queries) if key not in embedding_cache]
+    if keys:
+        embeddings = model.encode(keys)
+        for key, embedding in zip(keys, embeddings):
+            embedding_cache.set(key, embedding.reshape(1, -1))
+    return len(keys)
+
+def cache_stats():
+    return {"embeddings": embedding_cache.stats(), "results": result_cache.stats(), "semantic": semantic_cache.stats()}
+
+def answer_cache_key(query, index, k=1, threshold=0.20, reranked=False):
+    return ("answer", normalize_query(query), k, threshold, reranked, index_token(index))
+
+def answer_scope(k=1, threshold=0.20, reranked=False):
+    """Semantic-cache scope of the single-answer responses (answer_cache_key without query and index)"""
+    return ("answer", k, threshold, reranked)
+
+def best_answers(scores, indices, corpus, threshold=0.20):
+    """The single-answer response of retrieve_answer for every row of a FAISS result"""
+    columns = corpus_columns(corpus)
+    keep, _ = select_hits(indices[:, :1], columns, 1, scores[:, :1] >= threshold)
+    return [[columns.answers[idx]] if found else [FALLBACK_ANSWER]
+            for found, idx in zip(keep[:, 0].tolist(), indices[:, 0].tolist())]
+
+def best_answer(scores, indices, corpus, threshold=0.20):
+    """Turn one row of FAISS results into the single-answer response of retrieve_answer"""
+    return best_answers(np.atleast_2d(scores), np.atleast_2d(indices), corpus, threshold)[0]
+
 def retrieve_answer(query, model, corpus, index, k=1, threshold=0.20):
     """Original function for backward compatibility"""
-    query_embedding = model.encode([query], normalize_embeddings=True)
-    scores, indices = index.search(np.array(query_embedding, dtype=np.float32), k)
-    
-    best_score = scores[0][0]
-    best_idx = indices[0][0]
-    
-    if best_score < threshold or best_idx >= len(corpus):
-        return ["Not enough information available. Please contact [TLC Consultations](https://teaching.ucla.edu/services/consultations/) for further support."]
-    
-    return [corpus[best_idx]["answer"]]
-
-def enhanced_search(query, model, corpus, index, k=5, threshold=0.15):
-    """Enhanced search function that returns multiple results with metadata"""
-    query_embedding = model.encode([query], normalize_embeddings=True)
-    scores, indices = index.search(np.array(query_embedding, dtype=np.float32), k)
-    
-    results = []
-    for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-        if score >= threshold and idx < len(corpus):
-            results.append({
-                "question": corpus[idx]["question"],
-                "answer": corpus[idx]["answer"],
-                "category": corpus[idx].get("category", "General"),
-                "relevance_score": float(score),
-                "rank": i + 1
-            })
-    
-    return results
+    key = answer_cache_key(query, index, k, threshold)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    query_embedding = encode_query(query, model)
+    results = semantic_cache.get(answer_scope(k, threshold), query_embedding, index_token(index))
+    if results is None:
+        start = time.perf_counter()
+        scores, indices = index.search(query_embedding, k)
+        searched = time.perf_counter()
+        results = best_answer(scores[0], indices[0], corpus, threshold)
+        observe("search", searched - start)
+        observe("lookup", time.perf_counter() - searched)
+        semantic_cache.set(answer_scope(k, threshold), query_embedding, results, index_token(index))
+
+    result_cache.set(key, results)
+    return list(results)
+
+def answer_batch(queries, model, corpus, index, threshold=0.20):
+    """Answer many questions with one batched encode and one multi-query search.
+
+    Bulk jobs bypass the query caches so they don't evict interactive entries.
+    Returns one dict per query with the answer, its score, category and the
+    corpus question it matched (None below `threshold`).
+    """
+    columns = corpus_columns(corpus)
+    start = time.perf_counter()
+    embeddings = model.encode(list(queries))
+    encoded = time.perf_counter()
+    scores, indices = index.search(embeddings, 1)
+    searched = time.perf_counter()
+
+    keep, _ = select_hits(indices, columns, 1, scores >= threshold)
+    rows = []
+    for query, found, score, idx in zip(queries, keep[:, 0].tolist(), scores[:, 0].tolist(), indices[:, 0].tolist()):
+        if not found:
+            rows.append({"question": query, "answer": FALLBACK_ANSWER, "score": score,
+                         "category": None, "matched_question": None})
+            continue
+        rows.append({"question": query, "answer": columns.answers[idx], "score": score,
+                     "category": columns.categories[columns.category_codes[idx]], "matched_question": columns.questions[idx]})
+    observe("encode", encoded - start)
+    observe("search", searched - encoded)
+    observe("lookup", time.perf_counter() - searched)
+    return rows
+
+def iter_question_records(lines):
+    """Records from JSONL lines: {"question": ...} objects (other keys kept) or bare JSON strings"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield {"question": record} if isinstance(record, str) else record
+
+def answer_stream(records, model, corpus, index, chunk_size=256, threshold=0.20):
+    """Yield an answer row per record ({"question": ..., other keys passed through}), chunk by chunk.
+
+    Only one chunk of `records` is held at a time, so an input stream of any
+    length answers in flat memory.
+    """
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        answers = answer_batch([record["question"] for record in chunk], model, corpus, index, threshold)
+        for record, answer in zip(chunk, answers):
+            yield {**record, **answer}
+
+def enhanced_search(query, model, corpus, index, k=5, threshold=0.15, lexical=None, dedup=True, reranker=None, diversity=0.0):
+    """Enhanced search function that returns multiple results with metadata.
+
+    With `dedup`, a result whose answer text repeats a higher-ranked one (the
+    same Q&A in both corpora) is skipped. With `diversity` in (0, 1] the k
+    results are chosen by maximal marginal relevance, trading score for
+    distance from the results already picked. With a `reranker`
+    (rerank.Reranker), its top candidates are reordered by the cross-encoder
+    before the first k are returned.
+    """
+    if reranker is not None:
+        # Paraphrases also skip the cross-encoder, which costs far more than the search
+        scope = ("reranked", k, threshold, lexical is not None, dedup, diversity, reranker.model_name)
+        query_embedding = encode_query(query, model)
+        results = semantic_cache.get(scope, query_embedding, index_token(index))
+        if results is None:
+            candidates = enhanced_search(query, model, corpus, index, max(k, reranker.candidates), threshold, lexical, dedup,
+                                         diversity=diversity)
+            results = reranker.rerank(query, candidates)[:k]
+            # Keep the dense order out of the cache when the reranker fell back, so a later call can rerank
+            if all("rerank_score" in result for result in results):
+                semantic_cache.set(scope, query_embedding, results, index_token(index))
+        return [dict(result) for result in results]
+    if lexical is not None:
+        return hybrid_search(query, model, corpus, index, lexical, k=k, threshold=threshold, dedup=dedup, diversity=diversity)
+
+    key = ("enhanced", normalize_query(query), k, threshold, dedup, diversity, index_token(index))
+    cached = result_cache.get(key)
+    if cached is not None:
+        return [dict(result) for result in cached]
+
+    query_embedding = encode_query(query, model)
+    scope = ("enhanced", k, threshold, dedup, diversity)
+    results = semantic_cache.get(scope, query_embedding, index_token(index))
+    if results is None:
+        fetch = 4 * k if diversity else 2 * k if dedup else k
+        results = search_embeddings(query_embedding, corpus, index, k, threshold, dedup=dedup, fetch=fetch, diversity=diversity)[0]
+        semantic_cache.set(scope, query_embedding, results, index_token(index))
 
-def search_by_category(query, model, corpus, index, category, k=3):
-    """Search within a specific category"""
-    # Filter corpus by category
-    category_corpus = [item for item in corpus if item.get("category") == category]
-    
-    if not category_corpus:
+    result_cache.set(key, results)
+    return [dict(result) for result in results]
+
+def lexical_search(query, corpus, lexical, k=5, keyword_only=True):
+    """Answer a keyword-only query (e.g. "FERPA", "CAPS") from BM25 alone, without the transformer.
+
+    Returns None when the query is not keyword-only or nothing matches, so the
+    caller falls back to dense/hybrid search. Scores are relative to the top hit.
+    With keyword_only=False any query is answered lexically, e.g. while the
+    encoder is still loading.
+    """
+    if lexical is None or (keyword_only and not lexical.is_keyword_query(query)):
+        return None
+    start = time.perf_counter()
+    scores, indices = lexical.search(query, k)
+    observe("lexical", time.perf_counter() - start)
+    if not len(indices):
+        return None
+    ids = np.asarray(indices, dtype=np.int64)[None, :]
+    columns = corpus_columns(corpus)
+    keep, ranks = select_hits(ids, columns, k)
+    relative = np.asarray(scores)[None, :] / scores[0]
+    return assemble_results(relative, ids, keep, ranks, columns)[0]
+
+def fuse_rankings(dense_scores, dense_ids, lexical_scores, lexical_ids, fusion="rrf", alpha=0.7):
+    """Merge a dense and a BM25 ranking into [(row id, fused score, dense cosine or None)], best first.
+
+    "rrf" is reciprocal-rank fusion scaled so a row ranked first by both lists
+    scores 1.0; "weighted" mixes the cosine with the BM25 score relative to the
+    top lexical hit using `alpha` for the dense side.
+    """
+    dense = {int(idx): float(score) for score, idx in zip(dense_scores, dense_ids) if idx >= 0}
+    fused = {}
+    if fusion == "rrf":
+        for rank, idx in enumerate(dense):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+        for rank, idx in enumerate(lexical_ids):
+            fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (RRF_K + rank + 1)
+        scale = (RRF_K + 1) / 2.0
+        fused = {idx: score * scale for idx, score in fused.items()}
+    elif fusion == "weighted":
+        top = float(lexical_scores[0]) if len(lexical_scores) else 1.0
+        for idx, score in dense.items():
+            fused[idx] = alpha * score
+        for score, idx in zip(lexical_scores, lexical_ids):
+            fused[int(idx)] = fused.get(int(idx), 0.0) + (1.0 - alpha) * float(score) / top
+    else:
+        raise ValueError(f"Unknown fusion method: {fusion}")
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [(idx, fused[idx], dense.get(idx)) for idx in order]
+
+def hybrid_search(query, model, corpus, index, lexical, k=5, threshold=0.15, fusion="rrf", candidates=None, dedup=True,
+                  diversity=0.0):
+    """BM25 + dense retrieval with score fusion; keyword-only queries skip the transformer"""
+    key = ("hybrid", normalize_query(query), k, threshold, fusion, dedup, diversity, index_token(index))
+    cached = result_cache.get(key)
+    if cached is not None:
+        return [dict(result) for result in cached]
+
+    results = lexical_search(query, corpus, lexical, k)
+    if results is None:
+        candidates = candidates or max(4 * k, 20)
+        # BM25 scoring overlaps with the transformer forward pass
+        lexical_future = _lexical_pool.submit(lexical.search, query, candidates)
+        query_embedding = encode_query(query, model)
+        scope = ("hybrid", k, threshold, fusion, dedup, diversity)
+        results = semantic_cache.get(scope, query_embedding, index_token(index))
+        if results is None:
+            start = time.perf_counter()
+            dense_scores, dense_ids = index.search(query_embedding, candidates)
+            searched = time.perf_counter()
+            lexical_scores, lexical_ids = lexical_future.result()
+            # Only the part of BM25 that outlasted encode + search adds latency
+            waited = time.perf_counter()
+
+            fused = fuse_rankings(dense_scores[0], dense_ids[0], lexical_scores, lexical_ids, fusion)
+            ids = np.array([[idx for idx, _, _ in fused]], dtype=np.int64).reshape(1, -1)
+            scores = np.array([[score for _, score, _ in fused]], dtype=np.float64).reshape(1, -1)
+            cosines = np.array([[np.nan if cosine is None else cosine for _, _, cosine in fused]], dtype=np.float64).reshape(1, -1)
+            # Lexical matches are kept even when their cosine is below the dense threshold
+            columns = corpus_columns(corpus)
+            matched = np.isin(ids, lexical_ids) | (cosines >= threshold)
+            if diversity:
+                keep, _ = select_hits(ids, columns, ids.shape[1], matched, dedup=dedup)
+                scores, ids, keep, ranks = diversify_hits(index, scores, ids, keep, k, diversity)
+            else:
+                keep, ranks = select_hits(ids, columns, k, matched, dedup=dedup)
+            results = assemble_results(scores, ids, keep, ranks, columns)[0]
+            observe("search", searched - start)
+            observe("lexical_wait", waited - searched)
+            observe("fuse", time.perf_counter() - waited)
+            semantic_cache.set(scope, query_embedding, results, index_token(index))
+
+    result_cache.set(key, results)
+    return [dict(result) for result in results]
+
+def filtered_search(query, model, corpus, index, metadata, k=5, threshold=0.15, categories=None, tags=None,
+                    min_priority=None, updated_since=None, priority_boost=0.0, recency_boost=0.0):
+    """Dense search over the rows matching metadata filters, optionally boosted by priority and recency.
+
+    The filters are combined on metadata.MetadataIndex bitmaps and passed to
+    FAISS as a selector, so only matching rows are scored. With a boost, 4k
+    candidates are re-ranked by cosine + priority/recency bonuses.
+    """
+    key = ("filtered", normalize_query(query), k, threshold, categories and tuple(categories), tags and tuple(tags),
+           min_priority, updated_since, priority_boost, recency_boost, index_token(index))
+    cached = result_cache.get(key)
+    if cached is not None:
+        return [dict(result) for result in cached]
+
+    start = time.perf_counter()
+    bits = metadata.mask(categories, tags, min_priority, updated_since)
+    params, available = None, len(corpus)
+    if bits is not None:
+        available = metadata.count(bits)
+        parents = index.parents if isinstance(index, PassageIndex) else None
+        params = filtered_search_params(index, selector=metadata.selector(bits, parents))
+    observe("filter", time.perf_counter() - start)
+    if available == 0:
         return []
-    
-    # Create temporary index for category
-    model_temp = SentenceTransformer(MODEL_NAME)
-    texts = [item["question"] + " " + item["answer"] for item in category_corpus]
-    embeddings = model_temp.encode(texts, normalize_embeddings=True)
-    
-    dim = embeddings.shape[1]
-    temp_index = faiss.IndexFlatIP(dim)
-    temp_index.add(np.array(embeddings, dtype=np.float32))
-    
-    # Search
-    query_embedding = model.encode([query], normalize_embeddings=True)
-    scores, indices = temp_index.search(np.array(query_embedding, dtype=np.float32), k)
-    
-    results = []
-    for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-        if idx < len(category_corpus):
-            results.append({
-                "question": category_corpus[idx]["question"],
-                "answer": category_corpus[idx]["answer"],
-                "category": category_corpus[idx].get("category", category),
-                "relevance_score": float(score),
-                "rank": i + 1
-            })
-    
-    return results
+
+    boosting = priority_boost or recency_boost
+    boost = (lambda scores, indices: metadata.boost(scores, indices, priority_boost, recency_boost)) if boosting else None
+    query_embedding = encode_query(query, model)
+    scope = ("filtered",) + key[2:-1]
+    results = semantic_cache.get(scope, query_embedding, index_token(index))
+    if results is None:
+        results = search_embeddings(query_embedding, corpus, index, min(k, available), threshold, params=params,
+                                    fetch=min(4 * k, available) if boosting else None, boost=boost)[0]
+        semantic_cache.set(scope, query_embedding, results, index_token(index))
+
+    result_cache.set(key, results)
+    return [dict(result) for result in results]
+
+def build_category_ids(corpus, index=None):
+    """Map each category to the ids `index` searches over: corpus rows, or passages for a PassageIndex"""
+    columns = corpus_columns(corpus)
+    codes = np.asarray(columns.category_codes)
+    if isinstance(index, PassageIndex):
+        # Selectors filter passages, so a category is the passages of its rows
+        codes = codes[index.parents]
+    return {category: np.flatnonzero(codes == code).astype(np.int64) for code, category in enumerate(columns.categories)
+            if np.any(codes == code)}
+
+def search_by_category(query, model, corpus, index, category, k=3, category_ids=None):
+    """Search within a specific category as a filtered search on the main index"""
+    if category_ids is None:
+        category_ids = build_category_ids(corpus, index)
+    ids = category_ids.get(category)
+    if ids is None or len(ids) == 0:
+        return []
+
+    # Only rows of this category are scored; no re-encoding of the corpus
+    params = filtered_search_params(index, ids)
+    query_embedding = encode_query(query, model)
+    return search_embeddings(query_embedding, corpus, index, min(k, len(ids)), params=params)[0]
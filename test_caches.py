@@ -0,0 +1,99 @@
+"""Semantic answer cache, query log and precomputed answer table tests"""
+import gc
+import time
+import numpy as np
+import faiss
+
+from query_cache import SemanticCache
+from retrieve import index_token, semantic_cache
+from metrics import StageMetrics, QueryLog, read_query_logs
+from precompute import AnswerTable, mine_queries, head_queries
+
+def unit(*values):
+    vector = np.asarray([values], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def test_semantic_cache_matches_paraphrases():
+    cache = SemanticCache(min_cosine=0.9)
+    cache.set("ask", unit(1, 0, 0), "answer", 1)
+    assert cache.get("ask", unit(1, 0.1, 0), 1) == "answer"
+    assert cache.get("ask", unit(0, 1, 0), 1) is None
+    assert cache.get("search", unit(1, 0, 0), 1) is None
+
+def test_semantic_cache_skips_expired_nearest_entry():
+    cache = SemanticCache(min_cosine=0.9)
+    cache.set("ask", unit(1, 0.2, 0), "live", 1)
+    cache.ttl = -1
+    cache.set("ask", unit(1, 0, 0), "expired", 1)
+    assert cache.get("ask", unit(1, 0, 0), 1) == "live"
+    assert len(cache) == 1
+
+def test_semantic_cache_keeps_live_indexes_apart():
+    cache = SemanticCache()
+    cache.set("ask", unit(1, 0), "old bundle", 1)
+    cache.set("ask", unit(1, 0), "new bundle", 2)
+    # Requests still on the older index neither lose nor see the newer index's entries
+    for _ in range(2):
+        assert cache.get("ask", unit(1, 0), 1) == "old bundle"
+        assert cache.get("ask", unit(1, 0), 2) == "new bundle"
+    cache.retire(1)
+    assert cache.get("ask", unit(1, 0), 1) is None
+    assert cache.get("ask", unit(1, 0), 2) == "new bundle"
+    assert cache.stats()["invalidations"] == 1
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache = SemanticCache(maxsize=2)
+    for i, vector in enumerate((unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1))):
+        cache.set("ask", vector, i, 1)
+    assert cache.get("ask", unit(1, 0, 0), 1) is None
+    assert cache.get("ask", unit(0, 0, 1), 1) == 2
+    assert cache.stats()["evictions"] == 1
+
+def test_freed_index_retires_its_semantic_entries():
+    index = faiss.IndexFlatIP(2)
+    token = index_token(index)
+    semantic_cache.set("test", unit(1, 0), "cached", token)
+    assert semantic_cache.get("test", unit(1, 0), token) == "cached"
+    del index
+    gc.collect()
+    assert semantic_cache.get("test", unit(1, 0), token) is None
+
+def test_query_log_is_off_unless_installed():
+    metrics = StageMetrics()
+    with metrics.trace("ask", "what is ferpa"):
+        pass
+    assert metrics.query_log.stats()["logged"] == 0
+    assert metrics.query_log.stats()["directory"] is None
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_query_log_rotates(tmp_path):
+    log = QueryLog(directory=str(tmp_path), max_bytes=300, backups=2)
+    metrics = StageMetrics(query_log=log)
+    for i in range(30):
+        with metrics.trace("ask", f"question {i}"):
+            metrics.annotate("a matched question", 0.8)
+        # One entry per write so every file is checked for rotation
+        assert wait_for(lambda: log.logged == i + 1)
+    suffixes = {path.name.rpartition(".jsonl")[2] for path in tmp_path.iterdir()}
+    # Only `backups` rotated files are kept (the live file may have just been rotated away)
+    assert {".1", ".2"} <= suffixes <= {"", ".1", ".2"}
+    entries = list(read_query_logs(str(tmp_path)))
+    assert 0 < len(entries) < 30
+    assert all(entry["route"] == "ask" and entry["score"] == 0.8 for entry in entries)
+
+def test_answer_table_only_serves_its_bundle_version():
+    entries = [{"route": "ask", "q": "What is FERPA?", "score": 0.9, "hit": "FERPA"}] * 3 + \
+              [{"route": "ask", "q": "rare question", "score": 0.1}]
+    mined = mine_queries(entries)
+    assert head_queries(mined["ask"], min_count=3) == ["What is FERPA?"]
+
+    params = {"k": 1, "threshold": 0.2, "reranked": False}
+    table = AnswerTable("v1", {"ask": {"params": params, "entries": {"what is ferpa": ["A privacy law."]}}})
+    assert table.get("ask", "what is FERPA", "v1", params) == ["A privacy law."]
+    assert table.get("ask", "what is FERPA", "v2", params) is None
+    assert table.get("ask", "what is FERPA", "v1", {**params, "reranked": True}) is None
@@ -0,0 +1,141 @@
+"""Index build tests: chunked category search, incremental rebuilds with near-duplicates, the corpus store.
+
+The sentence-transformers model is replaced by FakeEncoder, which maps text
+to a fixed random unit vector, ignoring case and question marks, so
+"How do I apply?" and "how do I apply" are near-duplicates.
+"""
+import hashlib
+import numpy as np
+import pytest
+
+import embed_index
+from bundle import load_bundle
+from corpus_store import CorpusStore
+from batcher import QueryBatcher
+from reloader import BundleWatcher
+from retrieve import PassageIndex, build_category_ids, search_by_category
+
+LONG_ANSWER = " ".join(f"Sentence number {i} about records." for i in range(120))
+
+class FakeEncoder:
+    """Stands in for both embed_index.PassageEncoder and a query model"""
+    texts = []
+
+    def __init__(self, workers=1, batch_size=64):
+        self.encoded = 0
+        self.seconds = 1e-9
+
+    def encode(self, texts, **kwargs):
+        FakeEncoder.texts.extend(texts)
+        self.encoded += len(texts)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.lower().replace("?", "").encode('utf-8')).digest()[:4], "little")
+            vectors.append(np.random.default_rng(seed).normal(size=32))
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def build(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(embed_index, "PassageEncoder", FakeEncoder)
+
+    def run(records, **kwargs):
+        FakeEncoder.texts = []
+        capsys.readouterr()
+        embed_index.create_faiss_index([dict(item) for item in records], bundle_dir=str(tmp_path / "bundle"),
+                                       dedup_report_path=str(tmp_path / "dedup.json"), **kwargs)
+        return capsys.readouterr().out
+
+    run.bundle_dir = str(tmp_path / "bundle")
+    return run
+
+def summary_line(output):
+    return next((line for line in output.splitlines() if line.startswith("🔁")), None)
+
+def records():
+    return [
+        {"question": "How do I apply for a grant?", "answer": "Use the grants portal.", "category": "Grants & Funding"},
+        {"question": "What does FERPA cover?", "answer": LONG_ANSWER, "category": "Legal & Compliance"},
+        {"question": "how do I apply for a grant", "answer": "Use the grants portal.", "category": "Grants & Funding"},
+        {"question": "Where is the center?", "answer": "In Powell Library.", "category": "General"},
+        {"question": "When is the center open?", "answer": "Weekdays 9 to 5.", "category": "General"},
+    ]
+
+def test_category_search_on_chunked_bundle(build):
+    build(records(), dedup_threshold=None)
+    bundle = load_bundle(build.bundle_dir)
+    assert isinstance(bundle.index, PassageIndex)
+    assert len(bundle.parents) > len(bundle.corpus)
+
+    ids = build_category_ids(bundle.corpus, bundle.index)
+    assert {category: list(found) for category, found in ids.items()} == \
+           {category: list(found) for category, found in bundle.category_ids.items()}
+    for category in ("General", "Legal & Compliance", "Grants & Funding"):
+        expected = {item["question"] for item in bundle.corpus if item["category"] == category}
+        results = search_by_category("center hours", FakeEncoder(), bundle.corpus, bundle.index, category, k=5)
+        assert {result["question"] for result in results} == expected
+        assert all(result["category"] == category for result in results)
+    bundle.close()
+
+def test_passage_index_returns_distinct_parents(build):
+    build(records(), dedup_threshold=None)
+    bundle = load_bundle(build.bundle_dir)
+    query = np.asarray(bundle.embeddings[int(np.flatnonzero(np.asarray(bundle.parents) == 1)[0])], dtype=np.float32)
+    scores, indices = bundle.index.search(query[None, :], 3)
+    assert indices[0, 0] == 1
+    assert len(set(indices[0].tolist())) == 3
+    assert np.all(np.diff(scores[0]) <= 0)
+    bundle.close()
+
+def test_incremental_rebuild_with_duplicates(build):
+    output = build(records())
+    assert "Merged 1 near-duplicates" in output
+    assert len(load_bundle(build.bundle_dir).corpus) == 4
+
+    # Nothing changed: the dropped duplicate is reused too
+    output = build(records())
+    assert FakeEncoder.texts == []
+    assert summary_line(output) == "🔁 Incremental build: 0 added, 0 updated, 0 deleted, 5 unchanged"
+
+    edited = records()
+    edited[3]["answer"] = "In Kerckhoff Hall."
+    del edited[4]
+    edited.append({"question": "Who runs the center?", "answer": "The TLC staff.", "category": "General"})
+    output = build(edited)
+    assert len(FakeEncoder.texts) == 2
+    assert summary_line(output) == "🔁 Incremental build: 1 added, 1 updated, 1 deleted, 3 unchanged"
+
+def test_full_rebuild_encodes_everything(build):
+    build(records())
+    build(records(), incremental=False)
+    assert len(FakeEncoder.texts) == len(set(FakeEncoder.texts)) > len(records())
+
+def test_empty_corpus_is_rejected(build):
+    with pytest.raises(ValueError, match="Nothing to index"):
+        build([])
+
+def test_batcher_answers_from_reloaded_bundle(build):
+    build(records(), dedup_threshold=None)
+    watcher = BundleWatcher(build.bundle_dir, interval=0)
+    batcher = QueryBatcher(FakeEncoder(), watcher=watcher)
+    # The query is the embedded text of a corpus record, so its cosine is 1
+    assert batcher.ask("Where is the center? In Powell Library.") == ["In Powell Library."]
+
+    edited = records()
+    edited[3]["answer"] = "In Kerckhoff Hall."
+    build(edited, dedup_threshold=None)
+    assert watcher.check()
+    assert batcher.ask("Where is the center? In Kerckhoff Hall.") == ["In Kerckhoff Hall."]
+    assert batcher.stats()["batches"] == 2
+
+def test_corpus_store_round_trip():
+    items = records() + [{"question": "Tagged?", "answer": "Yes.", "category": "General", "priority": "high",
+                          "tags": ["b", "a"], "last_updated": "2025-08-05"}]
+    store = CorpusStore.from_records(iter(items))
+    assert store.categories == sorted({item["category"] for item in items})
+    assert store.tags == ["a", "b"]
+    assert store[-1] == items[-1]
+    assert [item["question"] for item in store] == [item["question"] for item in items]